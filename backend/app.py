@@ -3,50 +3,79 @@
 # Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
 #-----------------------------------------------------------------------
 
-from flask import Flask, send_from_directory, jsonify, request, session
+from flask import Flask, jsonify, request, session
+from flask import Response
 from dotenv import load_dotenv
 from .authenticate import authenticate
+from .database import get_connection, pool_stats, eventlet_patched
+from .feed_cache import card_feed, card_feed_with_counts
+from .feed_cache import cards_changed, comments_changed
+from .feed_cache import TOMBSTONE_RETENTION
+from .stream import event_hub
+from .mailer import queue_email
+from .ttl_cache import TTLCache
+from .static_assets import build_index, asset_response
+from .serialize import FastJSONProvider, dumps, fetch_dicts, fetch_dict
+from .serialize import SQL_JSON, sql_json_object
+from .sanitize import clean_text
+from .tags import canonical_tags
+from . import profiling
+from . import metrics
+from . import sessions
 import os
-import psycopg2
 import secrets
-from flask_mail import Mail, Message
-import bleach
-from datetime import datetime, timedelta
-import pytz
-import schedule
-import time
-import html
-import threading
-import requests
-from bs4 import BeautifulSoup
+from datetime import datetime, timedelta, timezone
+import hashlib
+import re
+import math
 
 #-----------------------------------------------------------------------
 
-# Initialize the database
+# Load environment variables
 load_dotenv()
-DATABASE_URL = os.environ.get('DATABASE_URL')
-conn = psycopg2.connect(DATABASE_URL)
 
 # Initialize Flask app
 app = Flask(__name__, static_folder='build')
 
-# Set up secret key
-app.secret_key = secrets.token_hex(32)
+# Serialize responses with the fast encoder
+app.json = FastJSONProvider(app)
 
-# Email configuration
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 465
-app.config['MAIL_USERNAME'] = os.getenv('EMAIL_USER')
-app.config['MAIL_PASSWORD'] = os.getenv('EMAIL_PASS')
-app.config['MAIL_USE_TLS'] = False
-app.config['MAIL_USE_SSL'] = True
-mail = Mail(app)
+# Export request metrics at /metrics
+metrics.init_app(app)
 
-# Define relevant URLs
-rss_url = os.environ['RSS_URL']
+# Time and count the work of every request when PROFILE_REQUESTS=true
+if profiling.PROFILE_REQUESTS:
+    profiling.init_app(app)
 
-# Set timezone used in RSS script
-utc = pytz.timezone('UTC')
+# Index and precompress the React build once per process
+static_index = build_index(app.static_folder)
+
+# Set up secret key. It must be shared by every worker, or each one
+# rejects the others' session cookies and users go back through CAS;
+# the random fallback is only fit for a single development process.
+app.secret_key = os.environ.get('SECRET_KEY')
+if not app.secret_key:
+    print('SECRET_KEY is not set; sessions will not survive restarts '
+          'or work across workers')
+    app.secret_key = secrets.token_hex(32)
+
+# Keep sessions in signed cookies or in Postgres, per SESSION_BACKEND
+sessions.init_app(app)
+
+# How far each delta sync cursor is moved back to cover in-flight
+# transactions
+CHANGES_OVERLAP = timedelta(seconds=5)
+
+# Mean Earth radius used for distances, in meters
+EARTH_RADIUS_M = 6371000
+
+# Default and largest search radius for nearby cards, in meters
+DEFAULT_NEARBY_RADIUS = 1000
+MAX_NEARBY_RADIUS = 50000
+
+# Default and largest page sizes for paginated listings
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 #-----------------------------------------------------------------------
 
@@ -57,25 +86,72 @@ def serve(path):
     # Authenticate user when they access the site and store username
     username = authenticate()
     if username:
-        session['username'] = username
+        # Only write the session when it changes
+        if session.get('username') != username:
+            session['username'] = username
         add_user(username)
-        
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+
+    # Unknown paths fall back to index.html for client-side routing
+    asset = static_index.get(path) or static_index.get('index.html')
+    if asset is None:
+        return jsonify({"success": False,
+                        "message": "Frontend build not found"}), 404
+    return asset_response(app.response_class, request, asset)
 
 # Route to serve static files (like CSS, JS, images, etc.)
 @app.route('/static/<path:path>')
 def serve_static_files(path):
-    return send_from_directory(app.static_folder + '/static', path)
+    asset = static_index.get('static/' + path)
+    if asset is None:
+        return jsonify({"success": False,
+                        "message": "Not found"}), 404
+    return asset_response(app.response_class, request, asset)
 
 #-----------------------------------------------------------------------
 
+# Build a strong ETag from the values that identify a resource version
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+# Check the request's validators against the current version; the
+# ETag wins whenever the client sent one
+def is_not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return (last_modified.replace(microsecond=0)
+                <= request.if_modified_since)
+    return False
+
+# Answer 304 when the client is up to date, otherwise call build() to
+# produce the full response. Either way attach the validators.
+def conditional_response(etag, last_modified, build=None):
+    if is_not_modified(etag, last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Let browsers keep the body but revalidate on every poll
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+#-----------------------------------------------------------------------
+
+# NetIDs this process already registered, so add_user only reaches the
+# database once per user per hour
+registered_users = TTLCache(maxsize=10000, ttl=3600,
+                            name='registered_users')
+
 # Add user the the database once they're CAS authenticated
 def add_user(net_id):
+    if net_id in registered_users:
+        return
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
                 # Execute query to add a user to the database
                 cursor.execute('''
@@ -86,6 +162,7 @@ def add_user(net_id):
 
                 # Commit to the database
                 conn.commit()
+        registered_users.set(net_id)
     except Exception as ex:
         print(str(ex))
 
@@ -102,101 +179,464 @@ def get_user():
 
 #-----------------------------------------------------------------------
 
-# Clean expired cards
-def clean_expired_cards():
+# Report this worker's database connection pool usage
+@app.route('/api/stats/pool', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+# Report this worker's per-route request totals when profiling is on
+@app.route('/api/stats/requests', methods=['GET'])
+def get_request_stats():
+    if not profiling.PROFILE_REQUESTS:
+        return jsonify({"success": False, "message":
+                        "Request profiling is disabled"}), 404
+    return jsonify(profiling.route_stats())
+
+#-----------------------------------------------------------------------
+
+# Read the keyset pagination parameters. Returns (None, None) when the
+# client asked for an unpaginated listing, and raises ValueError on
+# malformed input.
+def parse_keyset_args():
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    if limit is None and after is None:
+        return None, None
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    if after:
+        # Cursors look like "<posted_at>,<id>"
+        posted_at, _, row_id = after.rpartition(',')
+        after = (datetime.fromisoformat(posted_at), int(row_id))
+    else:
+        after = None
+    return limit, after
+
+# Wrap a page fetched with LIMIT limit + 1 together with the cursor
+# that continues after its last item
+def package_page(key, items, limit, id_key):
+    page = items[:limit]
+    next_cursor = None
+    if len(items) > limit:
+        last = page[-1]
+        next_cursor = f"{last['posted_at'].isoformat()},{last[id_key]}"
+    return {key: page, 'next': next_cursor}
+
+# Condition selecting unexpired cards, so reads never depend on when
+# the sweeper last ran
+ACTIVE_CARDS = 'expiration > LOCALTIMESTAMP'
+
+# Columns selected for card listings; their names are the JSON keys
+CARD_COLUMNS = '''card_id, title, photo_url, location, latitude,
+    longitude, dietary_tags, allergies, description, posted_at, net_id'''
+
+# Columns and join adding each card's comment count and latest comment
+# time, aggregated per card through the comments (card_id, posted_at)
+# index
+COMMENT_COUNT_COLUMNS = 'comment_count, latest_comment_at'
+COMMENT_COUNT_JOIN = '''LEFT JOIN LATERAL (
+    SELECT COUNT(*) AS comment_count,
+    MAX(comments.posted_at) AS latest_comment_at
+    FROM comments WHERE comments.card_id = cards.card_id
+    ) comment_counts ON TRUE'''
+
+# Timestamp columns among CARD_COLUMNS and COMMENT_COUNT_COLUMNS
+TIMESTAMP_COLUMNS = ('posted_at', 'latest_comment_at')
+
+# Query all active cards and serialize them for the feed snapshot,
+# which stays valid until the soonest card expires. With SQL_JSON the
+# document is built by Postgres and never decoded in Python.
+def build_card_feed(with_comment_counts=False):
+    columns = CARD_COLUMNS
+    join = ''
+    if with_comment_counts:
+        columns += ', ' + COMMENT_COUNT_COLUMNS
+        join = COMMENT_COUNT_JOIN
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Execute query to retrieve all active cards information
+            if SQL_JSON:
+                card = sql_json_object(
+                    [column.strip() for column in columns.split(',')],
+                    TIMESTAMP_COLUMNS)
+                cursor.execute(f'''
+                    SELECT COALESCE(json_agg({card}
+                    ORDER BY posted_at DESC), '[]')::text
+                    FROM cards {join} WHERE {ACTIVE_CARDS};
+                ''')
+                body = cursor.fetchone()[0].encode('utf-8')
+            else:
+                cursor.execute(f'''
+                    SELECT {columns}
+                    FROM cards {join} WHERE {ACTIVE_CARDS}
+                    ORDER BY posted_at DESC;
+                ''')
+                body = dumps(fetch_dicts(cursor))
+
+            # Seconds until the next card drops out of the feed
+            cursor.execute(f'''SELECT EXTRACT(EPOCH FROM
+                MIN(expiration) - LOCALTIMESTAMP)
+                FROM cards WHERE {ACTIVE_CARDS};''')
+            ttl = cursor.fetchone()[0]
+
+            return body, float(ttl) if ttl is not None else None
+
+# Read a comma-separated list of tags, e.g. "vegan,halal", in the
+# canonical case they are stored in
+def parse_list_arg(name):
+    value = request.args.get(name, '')
+    return sorted(canonical_tags(value.split(',')))
+
+# Version of the active cards, plus the newest comment when comment
+# counts are included. Cards that expire or are deleted lower the count
+# without moving the newest timestamp, so the version only works as an
+# ETag, never as Last-Modified. Comments are never edited or deleted on
+# their own, so the highest ID covers them.
+def card_set_version(cursor, with_comment_counts):
+    cursor.execute(f'''SELECT COUNT(*),
+        MAX(COALESCE(updated_at, posted_at))
+        FROM cards WHERE {ACTIVE_CARDS};''')
+    count, last_modified = cursor.fetchone()
+    latest_comment = None
+    if with_comment_counts:
+        cursor.execute('SELECT MAX(comment_id) FROM comments;')
+        latest_comment = cursor.fetchone()[0]
+    return count, last_modified, latest_comment
+
+# Query active cards carrying every dietary tag and none of the
+# excluded allergens, one keyset page at a time when limit is given
+def query_filtered_cards(cursor, dietary, exclude_allergens,
+                         limit=None, after=None,
+                         with_comment_counts=False):
+    columns = CARD_COLUMNS
+    join = ''
+    if with_comment_counts:
+        columns += ', ' + COMMENT_COUNT_COLUMNS
+        join = COMMENT_COUNT_JOIN
+    conditions = [ACTIVE_CARDS]
+    params = []
+    if dietary:
+        conditions.append('dietary_tags @> %s::VARCHAR[]')
+        params.append(dietary)
+    if exclude_allergens:
+        conditions.append('NOT (allergies && %s::VARCHAR[])')
+        params.append(exclude_allergens)
+    if after:
+        conditions.append('(posted_at, card_id) < (%s, %s)')
+        params.extend(after)
+    where = 'WHERE ' + ' AND '.join(conditions)
+    page = ''
+    if limit:
+        page = 'LIMIT %s'
+        params.append(limit + 1)
+
+    cursor.execute(f'''SELECT {columns}
+        FROM cards {join} {where}
+        ORDER BY posted_at DESC, card_id DESC {page};''', params)
+    cards = fetch_dicts(cursor)
+
+    if limit:
+        return package_page('cards', cards, limit, 'card_id')
+    return cards
+
+# API Route for fetching all active cards, optionally filtered by
+# dietary tags and excluded allergens, paginated by keyset, and with
+# comment counts included
+@app.route('/api/cards', methods=['GET'])
+def get_data():
+    dietary = parse_list_arg('dietary')
+    exclude_allergens = parse_list_arg('exclude_allergens')
+    with_comment_counts = request.args.get('comment_counts') in (
+        '1', 'true')
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        limit, after = parse_keyset_args()
+    except ValueError:
+        return jsonify({"success": False, "message":
+                        "Invalid pagination parameters"}), 400
+
+    try:
+        # Filtered results and keyset pages never touch the full
+        # snapshot. They revalidate against a cheap version of the
+        # active cards, and only the requested rows are fetched.
+        if dietary or exclude_allergens or limit:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    version = card_set_version(cursor,
+                                               with_comment_counts)
+                    etag = make_etag('cards', version, dietary,
+                                     exclude_allergens, limit, after)
+                    if is_not_modified(etag):
+                        return conditional_response(etag, None)
+                    cards = query_filtered_cards(
+                        cursor, dietary, exclude_allergens, limit,
+                        after, with_comment_counts)
+            return conditional_response(etag, None,
+                                        lambda: jsonify(cards))
+
+        # Serve the cached snapshot, rebuilding it only after a change
+        if with_comment_counts:
+            snapshot = card_feed_with_counts.get(
+                lambda: build_card_feed(with_comment_counts=True))
+        else:
+            snapshot = card_feed.get(build_card_feed)
+
+        response = conditional_response(
+            snapshot.etag, snapshot.last_modified,
+            lambda: app.response_class(snapshot.body,
+                                       mimetype='application/json'))
+        response.headers['X-Feed-Version'] = str(snapshot.version)
+        return response
+    except Exception as ex:
+        print(str(ex))
+        return jsonify({"success": False, "message": str(ex)}), 500
+        
+#-----------------------------------------------------------------------
+
+# API Route for fetching cards created, edited or deleted since a
+# cursor returned by a previous call
+@app.route('/api/cards/changes', methods=['GET'])
+def get_card_changes():
+    # Parse the opaque cursor, which is a database timestamp. Cursors
+    # handed out are always naive, so one with an offset is not ours.
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+            if since.tzinfo is not None:
+                raise ValueError('Cursor has a timezone')
+        except ValueError:
+            return jsonify({"success": False, "message":
+                            "Invalid cursor"}), 400
+
+    try:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    DELETE FROM cards WHERE expiration <= NOW();
-                """)
+                cursor.execute('SELECT LOCALTIMESTAMP;')
+                now = cursor.fetchone()[0]
+
+                # Cursors older than the tombstone log need a full
+                # resync, since some deletions are no longer recorded
+                reset = (not since or
+                         since < now - TOMBSTONE_RETENTION)
+
+                if reset:
+                    cursor.execute(f'''SELECT {CARD_COLUMNS}
+                        FROM cards WHERE {ACTIVE_CARDS}
+                        ORDER BY posted_at DESC;''')
+                    cards = fetch_dicts(cursor)
+                    deleted = []
+                else:
+                    # Cards inserted or updated since the cursor
+                    cursor.execute(f'''SELECT {CARD_COLUMNS}
+                        FROM cards
+                        WHERE COALESCE(updated_at, posted_at) > %s
+                        AND {ACTIVE_CARDS}
+                        ORDER BY posted_at DESC;''', [since])
+                    cards = fetch_dicts(cursor)
+
+                    # Cards that expired since the cursor but have not
+                    # been swept into the tombstone log yet
+                    cursor.execute('''SELECT card_id FROM cards
+                        WHERE expiration > %s
+                        AND expiration <= %s;''', [since, now])
+                    expired = [row[0] for row in cursor.fetchall()]
+
+                    # Cards deleted or expired since the cursor
+                    cursor.execute('''SELECT card_id
+                        FROM card_tombstones WHERE deleted_at > %s;''',
+                        [since])
+                    deleted = [row[0] for row in cursor.fetchall()]
+                    deleted.extend(expired)
+
+                # Step back so transactions still committing when we
+                # looked are picked up by the next call
+                cursor_value = (now - CHANGES_OVERLAP).isoformat()
+
+                return jsonify({
+                    'cards': cards,
+                    'deleted': deleted,
+                    'reset': reset,
+                    'cursor': cursor_value
+                })
     except Exception as ex:
         print(str(ex))
+        return jsonify({"success": False, "message": str(ex)}), 500
 
 #-----------------------------------------------------------------------
 
-# API Route for fetching all active cards
-@app.route('/api/cards', methods=['GET'])
-def get_data():
+# Read limit and offset query parameters, clamped to sane bounds
+def parse_page_args():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return None, None
+    return max(1, min(limit, MAX_PAGE_SIZE)), max(0, offset)
+
+# Turn free text into a prefix-matching tsquery, e.g. "free piz" into
+# "free:* & piz:*", so results update as the user types
+def build_search_query(text):
+    words = re.findall(r'\w+', text.lower())
+    return ' & '.join(word + ':*' for word in words)
+
+# API Route for ranked full-text search over active cards
+@app.route('/api/cards/search', methods=['GET'])
+def search_cards():
+    limit, offset = parse_page_args()
+    if limit is None:
+        return jsonify({"success": False, "message":
+                        "Invalid pagination parameters"}), 400
+
+    query = build_search_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({'cards': [], 'next_offset': None})
+
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
-                # Execute query to retrieve all active cards information
-                cursor.execute('''
-                    SELECT card_id, title, photo_url, location, 
-                    latitude, longitude, dietary_tags, allergies, 
-                    description, posted_at, net_id
-                    FROM cards ORDER BY posted_at DESC;
-                ''')
-                rows = cursor.fetchall()
+                # Fetch one extra row to learn whether a next page
+                # exists
+                cursor.execute(f'''SELECT {CARD_COLUMNS}
+                    FROM cards, to_tsquery('english', %s) query
+                    WHERE search_vector @@ query AND {ACTIVE_CARDS}
+                    ORDER BY ts_rank(search_vector, query) DESC,
+                    posted_at DESC
+                    LIMIT %s OFFSET %s;''', [query, limit + 1, offset])
+                cards = fetch_dicts(cursor)
+
+                next_offset = offset + limit if len(cards) > limit \
+                    else None
+                return jsonify({'cards': cards[:limit],
+                                'next_offset': next_offset})
+    except Exception as ex:
+        print(str(ex))
+        return jsonify({"success": False, "message": str(ex)}), 500
 
-                # Package queried data and send it over
-                cards = []
-                for row in rows:
-                    cards.append({
-                        'card_id': row[0],
-                        'title': html.unescape(row[1]),
-                        'photo_url': html.unescape(row[2]) if 
-                            row[2] else row[2],
-                        'location': html.unescape(row[3]) if 
-                            row[3] else row[3],
-                        'latitude': row[4],
-                        'longitude': row[5],
-                        'dietary_tags': row[6],
-                        'allergies': row[7],
-                        'description': html.unescape(row[8]) if 
-                            row[8] else row[8],
-                        'posted_at': row[9],
-                        'net_id': row[10]
-                    })
+#-----------------------------------------------------------------------
+
+# Latitude/longitude box that contains every point within radius_m of
+# (lat, lng), used to prefilter on the (latitude, longitude) index
+def bounding_box(lat, lng, radius_m):
+    lat_delta = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6:
+        lng_delta = 180.0
+    else:
+        lng_delta = min(180.0, lat_delta / cos_lat)
+    return (lat - lat_delta, lat + lat_delta,
+            lng - lng_delta, lng + lng_delta)
+
+# API Route for fetching active cards near a point, closest first
+@app.route('/api/cards/nearby', methods=['GET'])
+def get_nearby_cards():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius_m = float(request.args.get('radius_m',
+                                          DEFAULT_NEARBY_RADIUS))
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except (KeyError, ValueError):
+        return jsonify({"success": False, "message":
+                        "Invalid location parameters"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"success": False, "message":
+                        "Invalid location parameters"}), 400
+    radius_m = max(0.0, min(radius_m, MAX_NEARBY_RADIUS))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
 
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng,
+                                                      radius_m)
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                # Prefilter with the index, then rank by exact
+                # haversine distance
+                cursor.execute(f'''SELECT * FROM (
+                    SELECT {CARD_COLUMNS},
+                    2 * %(earth)s * ASIN(SQRT(
+                        POWER(SIN(RADIANS(latitude - %(lat)s) / 2), 2)
+                        + COS(RADIANS(%(lat)s)) * COS(RADIANS(latitude))
+                        * POWER(SIN(RADIANS(longitude - %(lng)s) / 2),
+                        2))) AS distance_m
+                    FROM cards
+                    WHERE latitude BETWEEN %(min_lat)s AND %(max_lat)s
+                    AND longitude BETWEEN %(min_lng)s AND %(max_lng)s
+                    AND {ACTIVE_CARDS}
+                    ) nearby
+                    WHERE distance_m <= %(radius)s
+                    ORDER BY distance_m
+                    LIMIT %(limit)s;''', {
+                        'earth': EARTH_RADIUS_M, 'lat': lat,
+                        'lng': lng, 'min_lat': min_lat,
+                        'max_lat': max_lat, 'min_lng': min_lng,
+                        'max_lng': max_lng, 'radius': radius_m,
+                        'limit': limit})
+
+                cards = fetch_dicts(cursor)
+                for card in cards:
+                    card['distance_m'] = round(card['distance_m'], 1)
                 return jsonify(cards)
     except Exception as ex:
         print(str(ex))
         return jsonify({"success": False, "message": str(ex)}), 500
-        
+
 #-----------------------------------------------------------------------
         
-# API Route for retrieving cards for a specific user
+# API Route for retrieving cards for a specific user, paginated by
+# keyset when limit or after is given
 @app.route('/api/cards/<string:net_id>', methods=['GET'])
 def retrieve_user_cards(net_id):
+    try:
+        limit, after = parse_keyset_args()
+    except ValueError:
+        return jsonify({"success": False, "message":
+                        "Invalid pagination parameters"}), 400
+
     try: 
         # Connect to the database and establish a cursor
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
-                # Define insertion query
-                insertion_query = '''SELECT card_id, title, photo_url,
-                    location, latitude, longitude, dietary_tags, 
-                    allergies, description, posted_at, net_id 
+                # Fetch the version of this user's cards
+                cursor.execute(f'''SELECT COUNT(*),
+                    MAX(COALESCE(updated_at, posted_at))
                     FROM cards WHERE net_id = %s
-                    ORDER BY posted_at DESC;
+                    AND {ACTIVE_CARDS};''', [net_id])
+                # Deletions and expiry lower the count without moving
+                # the newest timestamp, so only the ETag, which covers
+                # both, is a safe validator; no Last-Modified is sent
+                count, last_modified = cursor.fetchone()
+                etag = make_etag('cards', net_id, count, last_modified,
+                                 limit, after)
+                if is_not_modified(etag):
+                    return conditional_response(etag, None)
+
+                # Define retrieval query, resuming after the cursor
+                params = [net_id]
+                keyset = ''
+                if after:
+                    keyset = 'AND (posted_at, card_id) < (%s, %s)'
+                    params.extend(after)
+                page = ''
+                if limit:
+                    page = 'LIMIT %s'
+                    params.append(limit + 1)
+                retrieval_query = f'''SELECT {CARD_COLUMNS}
+                    FROM cards WHERE net_id = %s AND {ACTIVE_CARDS}
+                    {keyset}
+                    ORDER BY posted_at DESC, card_id DESC {page};
                 '''
                             
                 # Execute query to retrieve user's cards
-                cursor.execute(insertion_query, [net_id])
-                rows = cursor.fetchall()
+                cursor.execute(retrieval_query, params)
 
                 # Package queried data and send it over
-                cards = []
-                for row in rows:
-                    cards.append({
-                        'card_id': row[0],
-                        'title': html.unescape(row[1]),
-                        'photo_url': html.unescape(row[2]) if 
-                            row[2] else row[2],
-                        'location': html.unescape(row[3]) if 
-                            row[3] else row[3],
-                        'latitude': row[4],
-                        'longitude': row[5],
-                        'dietary_tags': row[6],
-                        'allergies': row[7],
-                        'description': html.unescape(row[8]) if 
-                            row[8] else row[8],
-                        'posted_at': row[9],
-                        'net_id': row[10]
-                    })
+                cards = fetch_dicts(cursor)
+                if limit:
+                    cards = package_page('cards', cards, limit,
+                                         'card_id')
 
-                return jsonify(cards)
+                return conditional_response(etag, None,
+                                           lambda: jsonify(cards))
     except Exception as ex:
         print(str(ex))
         return jsonify({"success": False, "message": str(ex)}), 500
@@ -208,13 +648,20 @@ def retrieve_user_cards(net_id):
 def delete_card(card_id):
     try:
         # Connect to the database and establish a cursor
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
                 # Definie deletion query
                 deletion_query = 'DELETE FROM cards WHERE card_id = %s;'
 
                 # Execute query to delete a card with given card_id
                 cursor.execute(deletion_query, [card_id])
+                if cursor.rowcount:
+                    # Record the deletion for delta sync clients
+                    cursor.execute('''INSERT INTO card_tombstones
+                        (card_id) VALUES (%s)
+                        ON CONFLICT (card_id) DO NOTHING;''',
+                        [card_id])
+                    cards_changed(cursor, 'card-deleted', card_id)
 
                 # Commit to the database
                 conn.commit()
@@ -239,21 +686,21 @@ def create_card():
 
         # Parse relevant fields
         net_id = card_data.get('net_id')
-        title = bleach.clean(card_data.get('title'))
-        description = bleach.clean(card_data.get('description'))
-        photo_url = bleach.clean(card_data.get('photo_url'))
-        location = bleach.clean(card_data.get('location'))
+        title = clean_text(card_data.get('title'))
+        description = clean_text(card_data.get('description'))
+        photo_url = clean_text(card_data.get('photo_url'))
+        location = clean_text(card_data.get('location'))
         latitude = float(card_data.get('latitude'))
         longitude = float(card_data.get('longitude'))
-        dietary_tags = card_data.get('dietary_tags')
-        allergies = card_data.get('allergies')
+        dietary_tags = canonical_tags(card_data.get('dietary_tags'))
+        allergies = canonical_tags(card_data.get('allergies'))
 
         # Package parsed data
         new_card = [net_id, title, description, photo_url, location,
                     latitude, longitude, dietary_tags, allergies]
         
         # Connect to database and establish a cursor
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
                 
                 # Define insertion query
@@ -263,11 +710,14 @@ def create_card():
                     posted_at)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s,
                     CURRENT_TIMESTAMP + interval \'3 hours\', 
-                    CURRENT_TIMESTAMP);
+                    CURRENT_TIMESTAMP)
+                    RETURNING card_id;
                 '''
 
                 # Execute query to store new card into the database
                 cursor.execute(insertion_query, new_card)
+                card_id = cursor.fetchone()[0]
+                cards_changed(cursor, 'card-created', card_id)
 
                 # Commit to the database
                 conn.commit()
@@ -288,21 +738,21 @@ def edit_card(card_id):
         card_data = request.get_json()
 
         # Get relevant fields
-        title = bleach.clean(card_data.get('title'))
-        description = bleach.clean(card_data.get('description'))
-        photo_url = bleach.clean(card_data.get('photo_url'))
-        location = bleach.clean(card_data.get('location'))
+        title = clean_text(card_data.get('title'))
+        description = clean_text(card_data.get('description'))
+        photo_url = clean_text(card_data.get('photo_url'))
+        location = clean_text(card_data.get('location'))
         latitude = float(card_data.get('latitude'))
         longitude = float(card_data.get('longitude'))
-        dietary_tags = card_data.get('dietary_tags')
-        allergies = card_data.get('allergies')
+        dietary_tags = canonical_tags(card_data.get('dietary_tags'))
+        allergies = canonical_tags(card_data.get('allergies'))
 
         # Packaged parsed data
         new_card = [title, description, photo_url, location, latitude,
                     longitude, dietary_tags, allergies, card_id]
         
         # Connect to database
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
                 # Define update query
                 update_query = '''UPDATE cards SET (title, description,
@@ -314,6 +764,8 @@ def edit_card(card_id):
                 '''
                 # Execute query to update row in the database
                 cursor.execute(update_query, new_card)
+                if cursor.rowcount:
+                    cards_changed(cursor, 'card-updated', card_id)
                 # Commit to database
                 conn.commit()
 
@@ -333,7 +785,7 @@ def retrieve_card(net_id, card_id):
             return jsonify({"error": "Invalid card_id"}), 400
         
         # Connect to database
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
                 # Define insertion query
                 retrieval_query = '''SELECT card_id, title, description,
@@ -342,33 +794,17 @@ def retrieve_card(net_id, card_id):
                     FROM cards WHERE card_id = %s;'''
                 # Execute query to retrieve card with given card_id
                 cursor.execute(retrieval_query, [card_id])
-                row = cursor.fetchone()
+                card = fetch_dict(cursor)
+                if card is None:
+                    return jsonify({"error": "Card not found"}), 404
 
                 # Check whether user is creator of card or an admin
-                card_owner = str(row[9])
+                card_owner = str(card['net_id'])
                 if card_owner != net_id and net_id != 'cs-tigerfoodies':
                     # User is not authorized to edit this card
                     return jsonify({"error": "Forbidden"}), 403
-                
-                if row:
-                    card = {
-                        "card_id": row[0],
-                        "title": html.unescape(row[1]),
-                        "description": html.unescape(row[2]) if 
-                            row[2] else row[2],
-                        "photo_url": html.unescape(row[3]) if 
-                            row[3] else row[3],
-                        "location": html.unescape(row[4]) if 
-                            row[4] else row[4],
-                        "latitude": row[5],
-                        "longitude": row[6],
-                        "dietary_tags": row[7],
-                        "allergies": row[8],
-                        "net_id": row[9]
-                    }
-                    return jsonify(card)
-                else:
-                    return jsonify({"error": "Card not found"}), 404
+
+                return jsonify(card)
 
     except Exception as ex:
         print(str(ex))
@@ -376,26 +812,25 @@ def retrieve_card(net_id, card_id):
             
 #-----------------------------------------------------------------------
 
-# API route for sending feedback email to our service account
+# API route for sending feedback email to our service account. The
+# email is queued in the outbox and sent by the background worker.
 @app.route('/api/feedback', methods=['POST'])
 def submit_feedback():
     # Retrieve feedback JSON object from frontend and unpackage it
     feedback_data = request.get_json()
     feedback_sender = feedback_data.get('net_id')
-    feedback_text = bleach.clean(feedback_data.get('feedback'))
+    feedback_text = clean_text(feedback_data.get('feedback'))
 
-    # Try to send email
+    # Try to queue email
     try:
-        msg = Message(
-            subject="TigerFoodies Bug",
-            sender=app.config['MAIL_USERNAME'],
-            recipients=['cs-tigerfoodies@princeton.edu'],
-            body=
+        body = \
         f"Feedback received from {feedback_sender}:\n\n{feedback_text}"
-        )
-        mail.send(msg)
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                queue_email(cursor, "TigerFoodies Bug",
+                            ['cs-tigerfoodies@princeton.edu'], body)
         return jsonify({"success": True, "message":
-                        "Action successful!"}), 200
+                        "Action successful!"}), 202
     except Exception as ex:
         print(ex)
         return jsonify({"success": False, "message":
@@ -403,32 +838,122 @@ def submit_feedback():
 
 #-----------------------------------------------------------------------
 
-# API Route for retrieving a specific card's comments
+# API Route for streaming card and comment events as Server-Sent Events
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    # A stream holds its worker for as long as the client stays, which
+    # only green workers can afford. Blocking workers would be pinned
+    # until gunicorn kills them at the timeout.
+    if not eventlet_patched():
+        return jsonify({"success": False, "message":
+                        "Streaming needs the eventlet worker"}), 503
+
+    # EventSource resends the last ID it saw when it reconnects; the
+    # query parameter lets a fresh page resume from a known point
+    last_event_id = (request.headers.get('Last-Event-ID')
+                     or request.args.get('last_event_id'))
+
+    return Response(event_hub.stream(last_event_id),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+#-----------------------------------------------------------------------
+
+# API Route for retrieving the comments of several cards in one query,
+# e.g. /api/comments?card_ids=1,2,3
+@app.route('/api/comments', methods=['GET'])
+def retrieve_batch_comments():
+    try:
+        card_ids = sorted({int(card_id) for card_id in
+                           request.args.get('card_ids', '').split(',')
+                           if card_id.strip()})
+    except ValueError:
+        return jsonify({"success": False, "message":
+                        "Invalid card_ids"}), 400
+    if len(card_ids) > MAX_PAGE_SIZE:
+        return jsonify({"success": False, "message":
+                        "Too many card_ids"}), 400
+
+    # Every requested card gets an entry, even without comments
+    comments = {str(card_id): [] for card_id in card_ids}
+    if not card_ids:
+        return jsonify(comments)
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''SELECT card_id, comment_id, net_id,
+                    comment, posted_at
+                    FROM comments WHERE card_id = ANY(%s)
+                    ORDER BY card_id, posted_at DESC,
+                    comment_id DESC;''', [card_ids])
+
+                # Group comments under their card
+                for comment in fetch_dicts(cursor):
+                    card_id = comment.pop('card_id')
+                    comments[str(card_id)].append(comment)
+                return jsonify(comments)
+    except Exception as ex:
+        print(str(ex))
+        return jsonify({"success": False, "message": str(ex)}), 500
+
+#-----------------------------------------------------------------------
+
+# API Route for retrieving a specific card's comments, paginated by
+# keyset when limit or after is given
 @app.route('/api/comments/<int:card_id>', methods=['GET'])
 def retrieve_card_comments(card_id):
+    try:
+        limit, after = parse_keyset_args()
+    except ValueError:
+        return jsonify({"success": False, "message":
+                        "Invalid pagination parameters"}), 400
+
     try:
         # Connect to database
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
-                # Define insertion query
-                retrieval_query = ''' SELECT net_id, comment, posted_at 
-                FROM comments WHERE card_id = %s 
-                ORDER BY posted_at DESC;'''
+                # Fetch the version of this card's comments
+                cursor.execute('''SELECT COUNT(*), MAX(posted_at)
+                    FROM comments WHERE card_id = %s;''', [card_id])
+                count, last_modified = cursor.fetchone()
+                etag = make_etag('comments', card_id, count,
+                                 last_modified, limit, after)
+                if count and is_not_modified(etag, last_modified):
+                    return conditional_response(etag, last_modified)
+
+                # Define retrieval query, resuming after the cursor
+                params = [card_id]
+                keyset = ''
+                if after:
+                    keyset = 'AND (posted_at, comment_id) < (%s, %s)'
+                    params.extend(after)
+                page = ''
+                if limit:
+                    page = 'LIMIT %s'
+                    params.append(limit + 1)
+                retrieval_query = f''' SELECT comment_id, net_id,
+                comment, posted_at 
+                FROM comments WHERE card_id = %s {keyset}
+                ORDER BY posted_at DESC, comment_id DESC {page};'''
                 # Execute query to retrieve card with given card_id
-                cursor.execute(retrieval_query, [card_id])
-                rows = cursor.fetchall()
-
-                # Package queried data and send it over
-                if rows:
-                    comments = []
-                    for row in rows:
-                        comments.append({
-                            'net_id': row[0],
-                            'comment': html.unescape(row[1]) if 
-                                row[1] else row[1],
-                            'posted_at': row[2],
-                        })
-                    return jsonify(comments)
+                cursor.execute(retrieval_query, params)
+
+                # Package queried data
+                comments = fetch_dicts(cursor)
+
+                # Pages may legitimately be empty
+                if limit:
+                    result = package_page('comments', comments, limit,
+                                          'comment_id')
+                    return conditional_response(
+                        etag, last_modified, lambda: jsonify(result))
+
+                # Send the full list over
+                if comments:
+                    return conditional_response(
+                        etag, last_modified, lambda: jsonify(comments))
                 else:
                     return jsonify({"error": "Card not found"}), 404
 
@@ -451,13 +976,13 @@ def create_card_comment(card_id):
 
         # Parse relevant fields
         net_id = new_comment_data.get('net_id')
-        comment = bleach.clean(new_comment_data.get('comment'))
+        comment = clean_text(new_comment_data.get('comment'))
 
         # Package parsed data
         new_comment = [net_id, comment, card_id]
        
         # Connect to database and establish a cursor
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with get_connection() as conn:
             with conn.cursor() as cursor:
                
                  # test for me to verify the card exists
@@ -476,6 +1001,7 @@ def create_card_comment(card_id):
 
                 # Execute query to store new card into the database
                 cursor.execute(insertion_query, new_comment)
+                comments_changed(cursor, 'comment-added', card_id)
                 
                 # Commit to the database
                 conn.commit()
@@ -488,91 +1014,6 @@ def create_card_comment(card_id):
 
 #-----------------------------------------------------------------------
 
-# Scrape listserv RSS script and add new cards to our database
-def fetch_recent_rss_entries():
-    try:
-        # Connect to database and establish a cursor
-        with psycopg2.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cursor:
-                # Start a session to carry over credential cookies
-                session = requests.Session()
-                
-                # Log into the listserv site
-                login_page = session.get(rss_url)
-                soup_login = BeautifulSoup(login_page.text, "lxml")
-                hidden_inputs = soup_login.find_all("input", 
-                                                    type="hidden")
-                payload = {input_tag["name"]: input_tag.get("value", "") 
-                        for input_tag in hidden_inputs}
-                payload["Y"] = os.environ["LISTSERV_USERNAME"]
-                payload["p"] = os.environ["PASS"]
-                session.post(rss_url, data=payload)
-
-                # Retrieve entries from freefood listserv RSS script
-                rss_response = session.get(rss_url)
-                soup_scrape = BeautifulSoup(rss_response.content, 
-                                            "xml")
-                items = soup_scrape.find_all("item")
-
-                # Define time threshold to retrieve most recent entries
-                time_threshold = datetime.now(utc) - timedelta(
-                    minutes=30)
-
-                # Loop to add new entries from scraper to database
-                for item in items:
-                    # If scraper finds old entry, break from loop, no
-                    # more new entries to add
-                    pubDate = datetime.strptime(
-                        item.pubDate.text, 
-                        "%a, %d %b %Y %H:%M:%S %z")
-                    if pubDate < time_threshold:
-                        break
-                    
-                    # Scrape relevant information from entry
-                    title = item.title.text
-
-                    # Check if the entry already exists in database
-                    check_query = """SELECT 1 FROM cards 
-                            WHERE title = %s
-                        """
-                    cursor.execute(check_query, (title,))
-                    if cursor.fetchone():
-                        # Skip this iteration if the title exists
-                        continue 
-
-                    # Package data to be inserted into database
-                    data = ["cs-tigerfoodies", title]
-                    # Create insertion query
-                    insertion_query = """INSERT INTO cards 
-                        (net_id, title, expiration, posted_at)
-                        VALUES (%s, %s, 
-                        CURRENT_TIMESTAMP + interval \'3 hours\', 
-                        CURRENT_TIMESTAMP)
-                    """
-                    # Execute insertion query
-                    cursor.execute(insertion_query, data)
-                    conn.commit()
-    except Exception as ex:
-        print(str(ex))
-
-#-----------------------------------------------------------------------
-
-# Run scheduled tasks
-schedule.every(60).seconds.do(clean_expired_cards)
-schedule.every(60).seconds.do(fetch_recent_rss_entries)
-
-# Make sure the scheduler is always active
-def run_scheduler():
-    while(True):
-        schedule.run_pending()
-        time.sleep(1)
-
-# Run the scheduler thread
-scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-scheduler_thread.start()
-
-#-----------------------------------------------------------------------
-
 # Start the Flask app
 if __name__ == '__main__':
     app.run(use_reloader=True, threaded=True)
\ No newline at end of file
@@ -2,14 +2,65 @@
 # authenticate.py
 #-----------------------------------------------------------------------
 
-import urllib.request
+import os
 import urllib.parse
 import re
+import threading
+import time
 import flask
+import requests
 
 #-----------------------------------------------------------------------
 
-_CAS_URL = 'https://fed.princeton.edu/cas/'
+# CAS server; overridden to point load tests at a stand-in
+_CAS_URL = os.environ.get('CAS_URL', 'https://fed.princeton.edu/cas/')
+
+# Connect and read timeouts for CAS validation, in seconds
+_CAS_TIMEOUT = (3, 5)
+
+# Consecutive failures that open the circuit, and how long it stays
+# open before a trial request is let through
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN = 30
+
+# Pooled HTTP client, so validations reuse TLS connections to CAS
+_cas_session = requests.Session()
+
+#-----------------------------------------------------------------------
+
+# Stops calling CAS for a while after repeated failures, so a slow CAS
+# server fails requests fast instead of tying up every worker.
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    # Whether a call may go through; once the cooldown has passed, one
+    # trial call is let through at a time
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self._cooldown:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._threshold:
+                self._opened_at = time.monotonic()
+
+_cas_breaker = CircuitBreaker(_BREAKER_THRESHOLD, _BREAKER_COOLDOWN)
 
 #-----------------------------------------------------------------------
 
@@ -26,17 +77,26 @@ def strip_ticket(url):
 
 # Validate a login ticket by contacting the CAS server. If
 # valid, return the user's username; otherwise, return None.
+# Abort with 503 when CAS is unreachable or the circuit is open.
 def validate(ticket):
+    if not _cas_breaker.allow():
+        flask.abort(503)
     val_url = (_CAS_URL + "validate" + '?service='
         + urllib.parse.quote(strip_ticket(flask.request.url))
         + '&ticket=' + urllib.parse.quote(ticket))
-    lines = []
-    with urllib.request.urlopen(val_url) as flo:
-        lines = flo.readlines()   # Should return 2 lines.
+    try:
+        response = _cas_session.get(val_url, timeout=_CAS_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as ex:
+        print(str(ex))
+        _cas_breaker.record_failure()
+        flask.abort(503)
+    _cas_breaker.record_success()
+    lines = response.text.splitlines()   # Should return 2 lines.
     if len(lines) != 2:
         return None
-    first_line = lines[0].decode('utf-8')
-    second_line = lines[1].decode('utf-8')
+    first_line = lines[0]
+    second_line = lines[1]
     if not first_line.startswith('yes'):
         return None
     return second_line.strip()
@@ -0,0 +1,519 @@
+#-----------------------------------------------------------------------
+# bench_load.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+# Load test of the API through the real gunicorn worker model, against
+# a throwaway Postgres seeded with synthetic data. Each scenario runs on
+# its own at fixed concurrency, and results are saved as JSON so runs
+# on different commits can be compared:
+#
+#   python -m backend.bench_load --database-url postgres:///bench \
+#       --cards 10000 --reset
+#   python -m backend.bench_load --database-url postgres:///bench \
+#       --compare bench-results/<old>.json
+#
+# Queries per request come from pg_stat_statements when the extension
+# is installed in the database, and are left out otherwise. With
+# --stream-clients, that many /api/stream clients stay connected while
+# the scenarios run. With --cas-clients, that many clients keep logging
+# in through a stand-in CAS server that answers after --cas-delay
+# seconds. Both are how the sync and eventlet worker classes are
+# compared (see gunicorn.conf.py).
+
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import psycopg2
+from psycopg2.extras import execute_values
+import requests
+
+#-----------------------------------------------------------------------
+
+# Vocabulary for synthetic cards
+DIETARY_TAGS = ['Vegetarian', 'Vegan', 'Halal', 'Kosher',
+                'Gluten-Free']
+ALLERGIES = ['Nuts', 'Dairy', 'Gluten', 'Shellfish', 'Soy', 'Eggs']
+FOODS = ['pizza', 'bagels', 'sushi', 'burritos', 'cookies', 'salad',
+         'dumplings', 'sandwiches', 'curry', 'donuts']
+PLACES = ['Frist Campus Center', 'Friend Center', 'CS Building',
+          'Lewis Library', 'Whitman College', 'Robertson Hall']
+
+# Princeton campus, where synthetic cards are scattered
+CAMPUS_LAT = 40.3467
+CAMPUS_LNG = -74.6551
+
+# Rows per INSERT while seeding
+SEED_BATCH_SIZE = 1000
+
+# Seconds before a request counts as failed
+REQUEST_TIMEOUT = 10
+
+#-----------------------------------------------------------------------
+
+def random_card_fields(rng):
+    food = rng.choice(FOODS)
+    return {
+        'title': f'Leftover {food} & drinks',
+        'description': f'Plenty of {food} left, bring a friend!',
+        'photo_url': f'https://example.com/{food}.jpg',
+        'location': rng.choice(PLACES),
+        'latitude': CAMPUS_LAT + rng.uniform(-0.01, 0.01),
+        'longitude': CAMPUS_LNG + rng.uniform(-0.01, 0.01),
+        'dietary_tags': rng.sample(DIETARY_TAGS, rng.randint(0, 2)),
+        'allergies': rng.sample(ALLERGIES, rng.randint(0, 3)),
+    }
+
+# Fill users, cards and comments. Comment counts are heavy-tailed so a
+# few popular cards carry most of the discussion.
+def seed(conn, card_count, seed_value):
+    rng = random.Random(seed_value)
+    user_count = max(10, card_count // 10)
+    net_ids = [f'bench{index:06d}' for index in range(user_count)]
+
+    with conn.cursor() as cursor:
+        execute_values(cursor, '''INSERT INTO users (net_id)
+            VALUES %s ON CONFLICT (net_id) DO NOTHING''',
+            [(net_id,) for net_id in net_ids])
+
+        card_ids = []
+        for start in range(0, card_count, SEED_BATCH_SIZE):
+            rows = []
+            for _ in range(start, min(start + SEED_BATCH_SIZE,
+                                      card_count)):
+                fields = random_card_fields(rng)
+                age = timedelta(minutes=rng.uniform(0, 170))
+                rows.append((rng.choice(net_ids), fields['title'],
+                             fields['description'],
+                             fields['photo_url'], fields['location'],
+                             fields['latitude'], fields['longitude'],
+                             fields['dietary_tags'],
+                             fields['allergies'], age))
+            card_ids.extend(row[0] for row in execute_values(
+                cursor, '''INSERT INTO cards (net_id, title,
+                description, photo_url, location, latitude, longitude,
+                dietary_tags, allergies, posted_at, expiration)
+                VALUES %s RETURNING card_id''', rows,
+                template='''(%s, %s, %s, %s, %s, %s, %s,
+                %s::VARCHAR[], %s::VARCHAR[],
+                LOCALTIMESTAMP - %s,
+                LOCALTIMESTAMP + interval '1 day')''',
+                page_size=SEED_BATCH_SIZE, fetch=True))
+
+        comments = []
+        for card_id in card_ids:
+            count = min(int(rng.paretovariate(1.2)) - 1, 200)
+            for index in range(count):
+                comments.append((card_id, rng.choice(net_ids),
+                                 f'Still some left? #{index}'))
+        for start in range(0, len(comments), SEED_BATCH_SIZE):
+            execute_values(cursor, '''INSERT INTO comments (card_id,
+                net_id, comment) VALUES %s''',
+                comments[start:start + SEED_BATCH_SIZE],
+                page_size=SEED_BATCH_SIZE)
+    conn.commit()
+    return net_ids, card_ids, len(comments)
+
+# Empty the tables the benchmark writes to
+def reset(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('''TRUNCATE users, cards, comments,
+            card_tombstones RESTART IDENTITY CASCADE;''')
+    conn.commit()
+
+#-----------------------------------------------------------------------
+
+# Total statements recorded by pg_stat_statements for this database,
+# or None when the extension is unavailable
+def statement_count(conn):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('''SELECT COALESCE(SUM(calls), 0)
+                FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database
+                WHERE datname = current_database())
+                AND query NOT LIKE '%pg_stat_statements%';''')
+            count = int(cursor.fetchone()[0])
+        conn.commit()
+        return count
+    except psycopg2.Error:
+        conn.rollback()
+        return None
+
+#-----------------------------------------------------------------------
+
+# Start gunicorn the way the Procfile does and wait until it answers.
+# The worker class comes from gunicorn.conf.py unless one is given.
+def start_server(database_url, port, workers, worker_class=None,
+                 cas_url=None):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    if cas_url:
+        env['CAS_URL'] = cas_url
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-m', 'gunicorn', 'backend.app:app',
+               '--workers', str(workers),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    if worker_class:
+        command.extend(['--worker-class', worker_class])
+    server = subprocess.Popen(command, cwd=root, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/stats/pool',
+                         timeout=1)
+            return server
+        except requests.RequestException:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+# Stand-in CAS server that accepts every ticket after delay seconds,
+# like a slow fed.princeton.edu. Returns the server and its base URL.
+def start_cas(port, delay):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            body = b'yes\nbench000000\n'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{port}/'
+
+#-----------------------------------------------------------------------
+
+# Build the request functions of every scenario. Each takes a session
+# and the base URL and returns the response.
+def make_scenarios(net_ids, card_ids, seed_value):
+    rng = random.Random(seed_value)
+    rng_lock = threading.Lock()
+
+    # Deletions walk through the seeded cards, newest first; once all
+    # are gone they delete nothing
+    deletable = itertools.cycle(reversed(card_ids))
+    deletable_lock = threading.Lock()
+
+    def pick(items):
+        with rng_lock:
+            return rng.choice(items)
+
+    def card_body():
+        with rng_lock:
+            fields = random_card_fields(rng)
+        return fields
+
+    def list_cards(session, base):
+        return session.get(f'{base}/api/cards',
+                           timeout=REQUEST_TIMEOUT)
+
+    def user_cards(session, base):
+        return session.get(f'{base}/api/cards/{pick(net_ids)}',
+                           timeout=REQUEST_TIMEOUT)
+
+    def card_comments(session, base):
+        return session.get(f'{base}/api/comments/{pick(card_ids)}',
+                           timeout=REQUEST_TIMEOUT)
+
+    def create_card(session, base):
+        body = card_body()
+        body['net_id'] = pick(net_ids)
+        return session.post(f'{base}/api/cards', json=body,
+                            timeout=REQUEST_TIMEOUT)
+
+    def edit_card(session, base):
+        return session.put(f'{base}/api/cards/{pick(card_ids)}',
+                           json=card_body(), timeout=REQUEST_TIMEOUT)
+
+    def delete_card(session, base):
+        with deletable_lock:
+            card_id = next(deletable)
+        return session.delete(f'{base}/api/cards/{card_id}',
+                              timeout=REQUEST_TIMEOUT)
+
+    # Deletion runs last since it shrinks the data set
+    return [('list_cards', list_cards), ('user_cards', user_cards),
+            ('card_comments', card_comments),
+            ('create_card', create_card), ('edit_card', edit_card),
+            ('delete_card', delete_card)]
+
+# Keep count Server-Sent Events clients connected until stop is set.
+# Returns the list of clients that failed or were cut off.
+def hold_streams(base, count, stop):
+    failed = []
+
+    # Heartbeats arrive every few seconds, so the stop flag is checked
+    # regularly; shutting the server down ends the rest
+    def client():
+        try:
+            with requests.get(f'{base}/api/stream', stream=True,
+                              timeout=(REQUEST_TIMEOUT, None)) \
+                    as response:
+                response.raise_for_status()
+                for _ in response.iter_lines():
+                    if stop.is_set():
+                        break
+        except requests.RequestException:
+            if not stop.is_set():
+                failed.append(1)
+
+    for _ in range(count):
+        threading.Thread(target=client, daemon=True).start()
+    return failed
+
+# Keep count clients logging in with fresh tickets until stop is set,
+# so every request waits on CAS. Returns a dict counting completed
+# and failed logins.
+def hold_logins(base, count, stop):
+    totals = {'logins': 0, 'failed_logins': 0}
+    lock = threading.Lock()
+
+    def client():
+        while not stop.is_set():
+            try:
+                ok = requests.get(f'{base}/?ticket=bench',
+                                  timeout=REQUEST_TIMEOUT).ok
+            except requests.RequestException:
+                ok = False
+            if stop.is_set():
+                break
+            with lock:
+                totals['logins' if ok else 'failed_logins'] += 1
+
+    for _ in range(count):
+        threading.Thread(target=client, daemon=True).start()
+    return totals
+
+# Percentile of sorted values by nearest rank
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1,
+                       int(round(fraction * len(values))) - 1))
+    return values[index]
+
+# Drive one scenario from concurrency threads for duration seconds
+def run_scenario(func, base, concurrency, duration, warmup):
+    latencies = []
+    errors = [0]
+    sent = [0]
+    lock = threading.Lock()
+    measuring = threading.Event()
+    stop = threading.Event()
+
+    def client():
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                ok = func(session, base).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                sent[0] += 1
+                if measuring.is_set():
+                    latencies.append(elapsed)
+                    if not ok:
+                        errors[0] += 1
+
+    threads = [threading.Thread(target=client, daemon=True)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    measuring.set()
+    start = time.perf_counter()
+    time.sleep(duration)
+    with lock:
+        measuring.clear()
+        elapsed = time.perf_counter() - start
+        measured = sorted(latencies)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'sent': sent[0],
+        'requests': len(measured),
+        'errors': errors[0],
+        'throughput_rps': round(len(measured) / elapsed, 2),
+        'p50_ms': _ms(percentile(measured, 0.50)),
+        'p95_ms': _ms(percentile(measured, 0.95)),
+        'p99_ms': _ms(percentile(measured, 0.99)),
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+#-----------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Print each metric next to the same metric of an earlier run
+def compare(results, baseline):
+    print(f'\ncompared with {baseline["commit"]}:')
+    for name, current in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        changes = []
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms',
+                       'queries_per_request'):
+            if current.get(metric) is None or not old.get(metric):
+                continue
+            change = (current[metric] - old[metric]) / old[metric]
+            changes.append(f'{metric} {change:+.1%}')
+        print(f'  {name:<14} ' + ', '.join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test the API against a throwaway database')
+    parser.add_argument('--database-url', required=True,
+                        help='throwaway database; its tables are '
+                        'created and filled')
+    parser.add_argument('--cards', type=int, default=1000,
+                        help='synthetic cards to seed (100 to 100000)')
+    parser.add_argument('--reset', action='store_true',
+                        help='empty the tables before seeding')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class',
+                        help='gunicorn worker class, e.g. sync; by '
+                        'default the one gunicorn.conf.py picks')
+    parser.add_argument('--stream-clients', type=int, default=0,
+                        help='SSE clients held open during the run')
+    parser.add_argument('--cas-clients', type=int, default=0,
+                        help='clients logging in through a slow '
+                        'stand-in CAS during the run')
+    parser.add_argument('--cas-delay', type=float, default=0.5,
+                        help='seconds the stand-in CAS takes to answer')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenarios', nargs='+',
+                        help='only run these scenarios')
+    parser.add_argument('--output', help='results file, by default '
+                        'bench-results/<commit>-<cards>.json')
+    parser.add_argument('--compare', help='earlier results file')
+    args = parser.parse_args()
+
+    # Create the schema in the throwaway database
+    os.environ['DATABASE_URL'] = args.database_url
+    from . import create_tables
+    create_tables.main()
+
+    conn = psycopg2.connect(args.database_url)
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM cards;')
+        existing = cursor.fetchone()[0]
+    if existing and not args.reset:
+        raise SystemExit('Database already has cards; pass --reset to '
+                         'empty it first')
+    if args.reset:
+        reset(conn)
+    net_ids, card_ids, comment_count = seed(conn, args.cards,
+                                            args.seed)
+    print(f'Seeded {len(net_ids)} users, {len(card_ids)} cards, '
+          f'{comment_count} comments')
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {key: getattr(args, key) for key in (
+            'cards', 'workers', 'worker_class', 'stream_clients',
+            'cas_clients', 'cas_delay', 'concurrency', 'duration',
+            'seed')},
+        'comments': comment_count,
+        'scenarios': {},
+    }
+
+    base = f'http://127.0.0.1:{args.port}'
+    cas, cas_url = None, None
+    if args.cas_clients:
+        cas, cas_url = start_cas(args.port + 1, args.cas_delay)
+    server = start_server(args.database_url, args.port, args.workers,
+                          args.worker_class, cas_url)
+    stop_streams = threading.Event()
+    try:
+        failed_streams = hold_streams(
+            base, args.stream_clients, stop_streams)
+        logins = hold_logins(base, args.cas_clients, stop_streams)
+        start = time.perf_counter()
+        for name, func in make_scenarios(net_ids, card_ids, args.seed):
+            if args.scenarios and name not in args.scenarios:
+                continue
+            before = statement_count(conn)
+            result = run_scenario(func, base, args.concurrency,
+                                  args.duration, args.warmup)
+            after = statement_count(conn)
+            # Statements cover the warmup too, so divide by every
+            # request sent
+            sent = result.pop('sent')
+            result['queries_per_request'] = None
+            if before is not None and after is not None:
+                result['queries_per_request'] = round(
+                    (after - before) / max(sent, 1), 2)
+            results['scenarios'][name] = result
+            print(f'{name:<14} {result["throughput_rps"]:>8} req/s  '
+                  f'p50 {result["p50_ms"]} ms  '
+                  f'p95 {result["p95_ms"]} ms  '
+                  f'p99 {result["p99_ms"]} ms  '
+                  f'queries/req {result["queries_per_request"]}  '
+                  f'errors {result["errors"]}')
+        results['failed_streams'] = len(failed_streams)
+        if args.cas_clients:
+            elapsed = time.perf_counter() - start
+            results['logins_per_second'] = round(
+                logins['logins'] / elapsed, 2)
+            results['failed_logins'] = logins['failed_logins']
+            print(f'logins {results["logins_per_second"]} /s  '
+                  f'failed {logins["failed_logins"]}')
+        if args.stream_clients:
+            print(f'failed streams {len(failed_streams)}')
+    finally:
+        stop_streams.set()
+        server.terminate()
+        server.wait()
+        if cas is not None:
+            cas.shutdown()
+        conn.close()
+
+    output = args.output or os.path.join(
+        'bench-results', f'{results["commit"]}-{args.cards}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Saved results to {output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
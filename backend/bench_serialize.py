@@ -0,0 +1,121 @@
+#-----------------------------------------------------------------------
+# bench_serialize.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+# Microbenchmark of turning card rows into a JSON body, comparing the
+# old per-route packing plus Flask's stdlib encoder with the shared
+# serializer. Needs no database:
+#
+#   python -m backend.bench_serialize [--rows 1000 10000] [--repeat 5]
+
+import argparse
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from werkzeug.http import http_date
+from . import serialize
+
+#-----------------------------------------------------------------------
+
+Column = namedtuple('Column', ['name'])
+
+# Stand-in for a psycopg2 cursor that has just run a CARD_COLUMNS query
+class FakeCursor:
+    def __init__(self, rows):
+        self.description = [Column(name) for name in (
+            'card_id', 'title', 'photo_url', 'location', 'latitude',
+            'longitude', 'dietary_tags', 'allergies', 'description',
+            'posted_at', 'net_id')]
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+# Synthetic rows shaped like real cards. Text is stored as written, so
+# some of it carries characters HTML would escape.
+def make_rows(count):
+    now = datetime(2024, 11, 1, 12, 0, 0)
+    return [(card_id, f'Leftover pizza & salad #{card_id}',
+             f'https://example.com/photos/{card_id}.jpg',
+             'Frist Campus Center <2nd floor>',
+             40.3467 + card_id * 1e-6, -74.6551 - card_id * 1e-6,
+             ['Vegetarian', 'Halal'], ['Gluten', 'Dairy'],
+             'Plenty left in the lounge, bring a container! ' * 3,
+             now - timedelta(seconds=card_id), f'user{card_id % 500}')
+            for card_id in range(count)]
+
+#-----------------------------------------------------------------------
+
+# The packing every route used to do by position, now that stored text
+# needs no unescaping
+def package_card(row):
+    return {
+        'card_id': row[0],
+        'title': row[1],
+        'photo_url': row[2],
+        'location': row[3],
+        'latitude': row[4],
+        'longitude': row[5],
+        'dietary_tags': row[6],
+        'allergies': row[7],
+        'description': row[8],
+        'posted_at': row[9],
+        'net_id': row[10]
+    }
+
+# What Flask's default provider did with the result
+def _flask_default(value):
+    if isinstance(value, datetime):
+        return http_date(value)
+    raise TypeError(type(value).__name__)
+
+def before(cursor):
+    cards = [package_card(row) for row in cursor.fetchall()]
+    return json.dumps(cards, default=_flask_default, sort_keys=True,
+                      ensure_ascii=True,
+                      separators=(',', ':')).encode('utf-8')
+
+def after(cursor):
+    return serialize.dumps(serialize.fetch_dicts(cursor))
+
+#-----------------------------------------------------------------------
+
+# Best wall time of repeat runs, in seconds
+def best_time(func, cursor, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(cursor)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark card serialization')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'encoder: {serialize.JSON_ENCODER}')
+    print(f'{"rows":>8} {"before us/row":>14} {"after us/row":>13} '
+          f'{"speedup":>8}')
+    for count in args.rows:
+        cursor = FakeCursor(make_rows(count))
+
+        # Both paths must produce the same document
+        if json.loads(before(cursor)) != json.loads(after(cursor)):
+            raise SystemExit('Serializers disagree')
+
+        old = best_time(before, cursor, args.repeat)
+        new = best_time(after, cursor, args.repeat)
+        print(f'{count:>8} {old / count * 1e6:>14.2f} '
+              f'{new / count * 1e6:>13.2f} {old / new:>7.1f}x')
+
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,92 @@
 #-----------------------------------------------------------------------
 
 import os
+import html
 import psycopg2
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 #-----------------------------------------------------------------------
 
-# Obtain database URL
+# Obtain database URL, and the listserv feed whose import state is
+# seeded
 load_dotenv()
 DATABASE_URL = os.environ['DATABASE_URL']
+RSS_URL = os.environ.get('RSS_URL')
+
+# Text columns that used to be stored HTML-escaped, by table, after the
+# table's key column
+ESCAPED_TEXT_COLUMNS = {
+    'cards': ['card_id', 'title', 'description', 'photo_url',
+              'location'],
+    'comments': ['comment_id', 'comment'],
+    'cards_archive': ['card_id', 'title', 'description', 'photo_url',
+                      'location'],
+    'comments_archive': ['comment_id', 'comment'],
+}
+
+#-----------------------------------------------------------------------
+
+# Run a one-time data migration unless it is already recorded
+def run_migration(cursor, name, migration):
+    cursor.execute('''INSERT INTO schema_migrations (name) VALUES (%s)
+        ON CONFLICT (name) DO NOTHING;''', (name,))
+    if not cursor.rowcount:
+        return
+    migration(cursor)
+    print(f"Successfully applied migration {name}!")
+
+# Rewrite text stored escaped by bleach.clean in the unescaped form
+# reads used to produce, so they can return it untouched
+def unescape_stored_text(cursor):
+    for table, (key, *columns) in ESCAPED_TEXT_COLUMNS.items():
+        # Only text containing an entity can change
+        cursor.execute(f'''SELECT {key}, {', '.join(columns)}
+            FROM {table} WHERE '''
+            + ' OR '.join(f"strpos({column}, '&') > 0"
+                          for column in columns) + ';')
+        rows = [(row[0], *(html.unescape(value) if value else value
+                           for value in row[1:]))
+                for row in cursor.fetchall()]
+        if not rows:
+            continue
+        assignments = ', '.join(f'{column} = new.{column}'
+                                for column in columns)
+        execute_values(cursor, f'''UPDATE {table} SET {assignments}
+            FROM (VALUES %s) AS new ({key}, {', '.join(columns)})
+            WHERE {table}.{key} = new.{key};''', rows)
+
+# Rewrite dietary tags and allergens in the canonical case of
+# tags.canonical_tag, which initcap matches, keeping their order
+def canonicalize_tag_case(cursor):
+    for table in ('cards', 'cards_archive'):
+        cursor.execute(f'''UPDATE {table} SET
+            dietary_tags = ARRAY(SELECT initcap(btrim(tag))
+                FROM unnest(dietary_tags) WITH ORDINALITY AS t(tag, n)
+                ORDER BY n),
+            allergies = ARRAY(SELECT initcap(btrim(tag))
+                FROM unnest(allergies) WITH ORDINALITY AS t(tag, n)
+                ORDER BY n)
+            WHERE cardinality(dietary_tags) > 0
+            OR cardinality(allergies) > 0;''')
+
+# Start the listserv import where the old title-matching scraper left
+# off. Its cards carry no source_id and there is no stored high-water
+# mark, so the first run would otherwise import the last
+# INITIAL_LOOKBACK of the feed again as duplicates. Cards were stamped
+# with the time they were imported, which is at or after the
+# publication of every entry the old scraper had seen.
+def seed_rss_state(cursor):
+    cursor.execute('''INSERT INTO rss_state (feed_url, last_pub_date)
+        SELECT %s, MAX(posted_at)::TIMESTAMPTZ FROM (
+            SELECT posted_at FROM cards
+            WHERE net_id = 'cs-tigerfoodies' AND source_id IS NULL
+            UNION ALL
+            SELECT posted_at FROM cards_archive
+            WHERE net_id = 'cs-tigerfoodies' AND source_id IS NULL
+        ) AS imported
+        HAVING MAX(posted_at) IS NOT NULL
+        ON CONFLICT (feed_url) DO NOTHING;''', (RSS_URL,))
 
 #-----------------------------------------------------------------------
 
@@ -60,6 +138,211 @@ def main():
             ''')
             print("Successfully created comments table!")
 
+            # Create the tombstone log of deleted and expired cards
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS card_tombstones (
+                    card_id INT PRIMARY KEY NOT NULL,
+                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+                );
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS card_tombstones_deleted_at_idx
+                ON card_tombstones (deleted_at);
+            ''')
+            print("Successfully created card tombstones table!")
+
+            # Index the last change time of each card for delta sync
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_changed_at_idx
+                ON cards ((COALESCE(updated_at, posted_at)));
+            ''')
+            print("Successfully created cards change index!")
+
+            # Create the sequence numbering live update events
+            cursor.execute('''
+            CREATE SEQUENCE IF NOT EXISTS event_ids;
+            ''')
+            print("Successfully created event sequence!")
+
+            # Add a weighted full-text search vector over the card text
+            cursor.execute('''
+            ALTER TABLE cards ADD COLUMN IF NOT EXISTS search_vector
+                tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english',
+                        COALESCE(title, '')), 'A') ||
+                    setweight(to_tsvector('english',
+                        COALESCE(location, '')), 'B') ||
+                    setweight(to_tsvector('english',
+                        COALESCE(description, '')), 'C')
+                ) STORED;
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_search_idx
+                ON cards USING GIN (search_vector);
+            ''')
+            print("Successfully created cards search index!")
+
+            # Index the dietary and allergen arrays for filtering
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_dietary_tags_idx
+                ON cards USING GIN (dietary_tags);
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_allergies_idx
+                ON cards USING GIN (allergies);
+            ''')
+            print("Successfully created cards dietary indexes!")
+
+            # Index coordinates for bounding-box nearby queries
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_location_idx
+                ON cards (latitude, longitude);
+            ''')
+            print("Successfully created cards location index!")
+
+            # Index the listing orders used by keyset pagination
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_posted_at_idx
+                ON cards (posted_at DESC, card_id DESC);
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_net_id_posted_at_idx
+                ON cards (net_id, posted_at DESC, card_id DESC);
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS comments_card_id_posted_at_idx
+                ON comments (card_id, posted_at DESC, comment_id DESC);
+            ''')
+            print("Successfully created pagination indexes!")
+
+            # Create the table tracking how far each RSS feed was read
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rss_state (
+                    feed_url TEXT PRIMARY KEY NOT NULL,
+                    last_pub_date TIMESTAMPTZ,
+                    last_guid TEXT,
+                    etag TEXT,
+                    last_modified TEXT
+                );
+            ''')
+            print("Successfully created RSS state table!")
+
+            # Key imported cards by their RSS source for deduplication
+            cursor.execute('''
+            ALTER TABLE cards ADD COLUMN IF NOT EXISTS source_id TEXT;
+            ''')
+            cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS cards_source_id_idx
+                ON cards (source_id);
+            ''')
+            print("Successfully created cards source index!")
+
+            # Index expiration so the sweeper finds expired cards fast
+            # and feed reads can skip them; posted_at rides along for
+            # the feed ordering. A partial index cannot be used here
+            # since now() is not immutable.
+            cursor.execute('''
+            DROP INDEX IF EXISTS cards_expiration_idx;
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS cards_expiration_posted_at_idx
+                ON cards (expiration, posted_at);
+            ''')
+            print("Successfully created cards expiration index!")
+
+            # Create the archives of expired cards and their comments,
+            # partitioned by the month they were archived in
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cards_archive (
+                        card_id INT NOT NULL,
+                        net_id VARCHAR(20),
+                        title VARCHAR(100) NOT NULL,
+                        description VARCHAR(250),
+                        photo_url TEXT,
+                        location VARCHAR(255),
+                        latitude DOUBLE PRECISION,
+                        longitude DOUBLE PRECISION,
+                        dietary_tags VARCHAR[],
+                        allergies VARCHAR[],
+                        expiration TIMESTAMP NOT NULL,
+                        posted_at TIMESTAMP NOT NULL,
+                        updated_at TIMESTAMP,
+                        source_id TEXT,
+                        archived_at TIMESTAMP NOT NULL
+                ) PARTITION BY RANGE (archived_at);
+            ''')
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cards_archive_default
+                PARTITION OF cards_archive DEFAULT;
+            ''')
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS comments_archive (
+                    comment_id INT NOT NULL,
+                    card_id INT NOT NULL,
+                    net_id VARCHAR(20) NOT NULL,
+                    comment VARCHAR(200) NOT NULL,
+                    posted_at TIMESTAMP NOT NULL,
+                    archived_at TIMESTAMP NOT NULL
+                ) PARTITION BY RANGE (archived_at);
+            ''')
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS comments_archive_default
+                PARTITION OF comments_archive DEFAULT;
+            ''')
+            print("Successfully created archive tables!")
+
+            # Create the outbox of emails waiting to be sent
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                    email_id SERIAL PRIMARY KEY NOT NULL,
+                    subject TEXT NOT NULL,
+                    sender TEXT,
+                    recipients TEXT[] NOT NULL,
+                    body TEXT NOT NULL,
+                    status VARCHAR(10) DEFAULT 'pending' NOT NULL,
+                    attempts INT DEFAULT 0 NOT NULL,
+                    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    sent_at TIMESTAMP
+                );
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS email_outbox_pending_idx
+                ON email_outbox (next_attempt_at)
+                WHERE status = 'pending';
+            ''')
+            print("Successfully created email outbox table!")
+
+            # Create the server-side session store
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY NOT NULL,
+                    data JSONB NOT NULL,
+                    expires_at TIMESTAMP NOT NULL
+                );
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS sessions_expires_at_idx
+                ON sessions (expires_at);
+            ''')
+            print("Successfully created sessions table!")
+
+            # Create the log of one-time data migrations
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+                );
+            ''')
+            run_migration(cursor, 'unescape_stored_text',
+                          unescape_stored_text)
+            run_migration(cursor, 'canonicalize_tag_case',
+                          canonicalize_tag_case)
+            # The import state is per feed, so wait for RSS_URL
+            if RSS_URL:
+                run_migration(cursor, 'seed_rss_state', seed_rss_state)
+
             # Confirm that the tables were created successfully
             print('Created tables successfully!')
 
@@ -0,0 +1,310 @@
+#-----------------------------------------------------------------------
+# database.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+from . import profiling
+from .metrics import DB_ERRORS
+
+#-----------------------------------------------------------------------
+
+# Obtain database URL
+load_dotenv()
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Pool configuration, sized per gunicorn worker
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+POOL_MAX_USES = int(os.environ.get('DB_POOL_MAX_USES', 1000))
+POOL_CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', 30))
+
+#-----------------------------------------------------------------------
+
+# Under gunicorn's eventlet worker the standard library is already
+# green, but psycopg2 talks to its socket from C. Its wait callback
+# makes every query yield to other green threads instead of blocking
+# the whole worker. Also tells the app whether it runs in green threads.
+def eventlet_patched():
+    patcher = sys.modules.get('eventlet.patcher')
+    return patcher is not None and patcher.is_monkey_patched('socket')
+
+if eventlet_patched():
+    from psycogreen.eventlet import patch_psycopg
+    patch_psycopg()
+
+#-----------------------------------------------------------------------
+
+# Raised when no connection frees up within the checkout timeout
+class PoolTimeout(Exception):
+    pass
+
+#-----------------------------------------------------------------------
+
+# Cursor charging each statement's time and row count to the request
+# being profiled
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            profiling.add_query(time.perf_counter() - start,
+                                self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            profiling.add_query(time.perf_counter() - start,
+                                self.rowcount)
+
+#-----------------------------------------------------------------------
+
+# Thread-safe pool of psycopg2 connections shared by every route and
+# background job in a process
+class ConnectionPool:
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE,
+                 max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 max_uses=POOL_MAX_USES, check_idle=POOL_CHECK_IDLE):
+        self._dsn = dsn
+        self._min_size = min_size
+        self._max_size = max(max_size, min_size, 1)
+        self._timeout = timeout
+        self._max_uses = max_uses
+        self._check_idle = check_idle
+        self._cond = threading.Condition()
+
+        # Idle connections as (conn, uses, returned_at), newest last
+        self._idle = []
+        # Checked out connections mapped to their use count
+        self._in_use = {}
+        # Connections being opened or health checked outside the lock
+        self._opening = 0
+        self._checking = 0
+
+        # Counters reported through stats()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._discarded = 0
+
+        for _ in range(self._min_size):
+            self._idle.append((self._connect(), 0, time.monotonic()))
+
+    def _connect(self):
+        if profiling.PROFILE_REQUESTS:
+            return psycopg2.connect(self._dsn,
+                                    cursor_factory=TimedCursor)
+        return psycopg2.connect(self._dsn)
+
+    def _size(self):
+        return (len(self._idle) + len(self._in_use) + self._opening
+                + self._checking)
+
+    # Cheap liveness check for a connection about to be handed out
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != \
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - returned_at < self._check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    # Take the most recently used idle connection, or reserve room for
+    # a new one and return None, waiting until the deadline for either
+    def _reserve(self, deadline):
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._checking += 1
+                    return self._idle.pop(), waited
+
+                # Open a new connection if the pool has room
+                if self._size() < self._max_size:
+                    self._opening += 1
+                    return None, waited
+
+                # Otherwise wait for a connection to be returned
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    DB_ERRORS.labels('PoolTimeout').inc()
+                    raise PoolTimeout(
+                        'Timed out waiting for a database connection')
+                waited = True
+                self._cond.wait(remaining)
+
+    # Check out a connection, waiting up to the pool timeout
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self._timeout
+        waited = False
+        while True:
+            idle, waited_now = self._reserve(deadline)
+            waited = waited or waited_now
+            if idle is None:
+                break
+
+            # Check the connection outside the lock, since it may take
+            # a round trip to the server
+            conn, uses, returned_at = idle
+            try:
+                healthy = self._healthy(conn, returned_at)
+            except Exception:
+                healthy = False
+            with self._cond:
+                self._checking -= 1
+                if healthy:
+                    self._checkout(conn, uses, start, waited)
+                    return conn
+                self._discarded += 1
+                self._cond.notify()
+            self._close(conn)
+
+        try:
+            conn = self._connect()
+        except Exception as ex:
+            DB_ERRORS.labels(type(ex).__name__).inc()
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._checkout(conn, 0, start, waited)
+        return conn
+
+    def _checkout(self, conn, uses, start, waited):
+        wait = time.monotonic() - start
+        profiling.add_acquire(wait)
+        self._in_use[conn] = uses + 1
+        self._checkouts += 1
+        self._wait_time += wait
+        self._max_wait = max(self._max_wait, wait)
+        if waited:
+            self._waits += 1
+
+    # Return a connection, recycling it once it has been used too often
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Never hand an open transaction to the next borrower
+                if conn.get_transaction_status() != \
+                        psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            uses = self._in_use.pop(conn, 0)
+            if discard or conn.closed:
+                self._discarded += 1
+                self._close(conn)
+            elif self._max_uses and uses >= self._max_uses:
+                self._recycled += 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, uses, time.monotonic()))
+            self._cond.notify()
+
+    # Borrow a connection for a block; commit on success, roll back on
+    # error, then hand it back to the pool
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as ex:
+            if isinstance(ex, psycopg2.Error):
+                DB_ERRORS.labels(type(ex).__name__).inc()
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    # Snapshot of pool usage for sizing per worker
+    def stats(self):
+        with self._cond:
+            return {
+                'pid': os.getpid(),
+                'min_size': self._min_size,
+                'max_size': self._max_size,
+                'size': self._size(),
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_avg': round(
+                    self._wait_time / self._checkouts, 6)
+                    if self._checkouts else 0.0,
+                'wait_time_max': round(self._max_wait, 6),
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'discarded': self._discarded,
+            }
+
+    def closeall(self):
+        with self._cond:
+            for conn, _, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+#-----------------------------------------------------------------------
+
+# One pool per process, created lazily so that gunicorn workers never
+# share sockets inherited across fork()
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(DATABASE_URL)
+                _pool_pid = pid
+    return _pool
+
+# Borrow a pooled connection, used as `with get_connection() as conn:`
+def get_connection():
+    return get_pool().connection()
+
+# Report the current process's pool usage
+def pool_stats():
+    return get_pool().stats()
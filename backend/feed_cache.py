@@ -0,0 +1,148 @@
+#-----------------------------------------------------------------------
+# feed_cache.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from . import notifications
+from .metrics import CACHE_LOOKUPS
+
+#-----------------------------------------------------------------------
+
+# Upper bound on snapshot age, in case a notification is ever lost
+FEED_CACHE_MAX_AGE = float(os.environ.get('FEED_CACHE_MAX_AGE', 300))
+
+# How long deletions are remembered for delta sync clients, shared by
+# /api/cards/changes and the sweep that forgets tombstones
+TOMBSTONE_RETENTION = timedelta(days=1)
+
+# Serialized body plus the validators computed once when it was built
+Snapshot = namedtuple('Snapshot',
+                      ['version', 'body', 'etag', 'last_modified'])
+
+#-----------------------------------------------------------------------
+
+# Versioned, pre-serialized snapshot of a query result. The snapshot is
+# rebuilt lazily on the first read after an invalidation, and every
+# worker invalidates its copy when a NOTIFY arrives on any of the
+# channels.
+class SnapshotCache:
+    def __init__(self, name, channels, max_age=FEED_CACHE_MAX_AGE):
+        self._name = name
+        self._channels = channels
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._version = 0
+        self._snapshot = None
+        self._built_at = 0.0
+        self._expires_at = None
+        self._subscribed_pid = None
+
+        # Counters for cache effectiveness
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    # Drop the current snapshot so the next read rebuilds it
+    def invalidate(self, payload=None):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    def _subscribe(self):
+        pid = os.getpid()
+        if self._subscribed_pid != pid:
+            self._subscribed_pid = pid
+            for channel in self._channels:
+                notifications.listen(channel, self.invalidate)
+
+    def _fresh(self):
+        return (self._snapshot is not None
+                and self._snapshot.version == self._version
+                and time.monotonic() - self._built_at < self._max_age
+                and (self._expires_at is None
+                     or time.monotonic() < self._expires_at)
+                and notifications.is_listening())
+
+    # Return the current Snapshot, calling build() only when the
+    # snapshot is missing or stale. build() returns the encoded body
+    # and the number of seconds it stays valid, or None if only a change
+    # can invalidate it.
+    def get(self, build):
+        self._subscribe()
+        with self._lock:
+            if self._fresh():
+                self.hits += 1
+                CACHE_LOOKUPS.labels(self._name, 'hit').inc()
+                return self._snapshot
+        # Only one thread rebuilds; the others reuse its result
+        with self._build_lock:
+            with self._lock:
+                if self._fresh():
+                    self.hits += 1
+                    CACHE_LOOKUPS.labels(self._name, 'hit').inc()
+                    return self._snapshot
+                version = self._version
+                self.misses += 1
+                CACHE_LOOKUPS.labels(self._name, 'miss').inc()
+            body, ttl = build()
+            # Content hash keeps the ETag identical across workers
+            etag = hashlib.sha1(body).hexdigest()
+            last_modified = datetime.now(timezone.utc).replace(
+                microsecond=0)
+            with self._lock:
+                snapshot = Snapshot(version, body, etag, last_modified)
+                # Keep the result only if nothing changed meanwhile
+                if version == self._version:
+                    self._snapshot = snapshot
+                    self._built_at = time.monotonic()
+                    self._expires_at = None if ttl is None \
+                        else self._built_at + ttl
+            return snapshot
+
+    def stats(self):
+        with self._lock:
+            return {'version': self._version, 'hits': self.hits,
+                    'misses': self.misses}
+
+#-----------------------------------------------------------------------
+
+# Snapshots of the active card feed served by GET /api/cards, without
+# and with per-card comment counts
+card_feed = SnapshotCache('card_feed', [notifications.CARDS_CHANNEL])
+card_feed_with_counts = SnapshotCache(
+    'card_feed_with_counts',
+    [notifications.CARDS_CHANNEL, notifications.COMMENTS_CHANNEL])
+
+# Announce a change to a card from inside the writer's transaction and
+# drop this worker's snapshots right away
+def cards_changed(cursor, event, card_id):
+    notifications.publish(cursor, notifications.CARDS_CHANNEL, event,
+                          {'card_id': card_id})
+    card_feed.invalidate()
+    card_feed_with_counts.invalidate()
+
+# Announce the same change to several cards in one statement
+def many_cards_changed(cursor, event, card_ids):
+    if not card_ids:
+        return
+    notifications.publish_many(cursor, notifications.CARDS_CHANNEL,
+                               event, [{'card_id': card_id}
+                                       for card_id in card_ids])
+    card_feed.invalidate()
+    card_feed_with_counts.invalidate()
+
+# Announce a new comment on a card the same way
+def comments_changed(cursor, event, card_id):
+    notifications.publish(cursor, notifications.COMMENTS_CHANNEL, event,
+                          {'card_id': card_id})
+    card_feed_with_counts.invalidate()
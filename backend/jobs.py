@@ -0,0 +1,196 @@
+#-----------------------------------------------------------------------
+# jobs.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+from datetime import date, timedelta
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from .database import get_connection
+from .feed_cache import many_cards_changed, TOMBSTONE_RETENTION
+from .sanitize import clean_text
+from .metrics import RSS_FETCHES, RSS_ITEMS
+from . import rss
+
+#-----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Define relevant URLs
+rss_url = os.environ.get('RSS_URL')
+
+# Listserv client reused across RSS runs to keep its login session
+listserv = rss.ListservClient(rss_url)
+
+# Cards archived per transaction, and batches per sweep
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', 500))
+SWEEP_MAX_BATCHES = int(os.environ.get('SWEEP_MAX_BATCHES', 20))
+
+#-----------------------------------------------------------------------
+
+# Background jobs run by worker.py. They raise on failure so the
+# scheduler can record it.
+
+#-----------------------------------------------------------------------
+
+# Columns copied from live tables into their archives
+CARD_ARCHIVE_COLUMNS = '''card_id, net_id, title, description,
+    photo_url, location, latitude, longitude, dietary_tags, allergies,
+    expiration, posted_at, updated_at, source_id'''
+COMMENT_ARCHIVE_COLUMNS = '''comment_id, card_id, net_id, comment,
+    posted_at'''
+
+# Months whose archive partitions this process already created
+_archive_months = set()
+
+# First day of the month after the given date
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+# Create the monthly archive partitions for this month and the next, so
+# rows never land in the default partition
+def ensure_archive_partitions(today):
+    month = today.replace(day=1)
+    for start in (month, next_month(month)):
+        if start in _archive_months:
+            continue
+        end = next_month(start)
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    for table in ('cards_archive', 'comments_archive'):
+                        cursor.execute(f'''CREATE TABLE IF NOT EXISTS
+                            {table}_{start:%Y_%m} PARTITION OF {table}
+                            FOR VALUES FROM (%s) TO (%s);''',
+                            (start, end))
+            _archive_months.add(start)
+        except Exception as ex:
+            # Archiving still works through the default partition
+            print(str(ex))
+
+# Move one batch of expired cards and their comments to the archive.
+# Returns the number of cards moved.
+def archive_expired_batch():
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Claim a batch through the expiration index; rows locked
+            # by a concurrent edit are left for the next batch
+            cursor.execute('''SELECT card_id FROM cards
+                WHERE expiration <= NOW()
+                ORDER BY expiration LIMIT %s
+                FOR UPDATE SKIP LOCKED;''', (SWEEP_BATCH_SIZE,))
+            card_ids = [row[0] for row in cursor.fetchall()]
+            if not card_ids:
+                return 0
+
+            # Archive comments before the cascade removes them
+            cursor.execute(f'''INSERT INTO comments_archive
+                ({COMMENT_ARCHIVE_COLUMNS}, archived_at)
+                SELECT {COMMENT_ARCHIVE_COLUMNS}, NOW()
+                FROM comments WHERE card_id = ANY(%s);''', (card_ids,))
+
+            # Move the cards and leave tombstones behind
+            cursor.execute(f'''
+                WITH expired AS (
+                    DELETE FROM cards WHERE card_id = ANY(%s)
+                    RETURNING {CARD_ARCHIVE_COLUMNS}
+                ), archived AS (
+                    INSERT INTO cards_archive
+                    ({CARD_ARCHIVE_COLUMNS}, archived_at)
+                    SELECT {CARD_ARCHIVE_COLUMNS}, NOW() FROM expired
+                )
+                INSERT INTO card_tombstones (card_id)
+                SELECT card_id FROM expired
+                ON CONFLICT (card_id) DO NOTHING;
+            ''', (card_ids,))
+
+            # Announce the expired cards
+            many_cards_changed(cursor, 'card-deleted', card_ids)
+            return len(card_ids)
+
+# Clean expired cards in bounded batches, each in its own short
+# transaction so the sweep never holds long locks against feed reads
+def clean_expired_cards():
+    ensure_archive_partitions(date.today())
+
+    for _ in range(SWEEP_MAX_BATCHES):
+        if archive_expired_batch() < SWEEP_BATCH_SIZE:
+            break
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Forget tombstones older than any usable cursor
+            cursor.execute("""
+                DELETE FROM card_tombstones
+                WHERE deleted_at < LOCALTIMESTAMP - %s;
+            """, (TOMBSTONE_RETENTION,))
+
+# Delete server-side sessions that have expired
+def clean_expired_sessions():
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('''DELETE FROM sessions
+                WHERE expires_at <= LOCALTIMESTAMP;''')
+
+#-----------------------------------------------------------------------
+
+# Scrape listserv RSS script and add new cards to our database
+def fetch_recent_rss_entries():
+    # Load where the previous run left off
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            state = rss.load_state(cursor, rss_url)
+
+    # Retrieve entries from freefood listserv RSS script, skipping
+    # all parsing when the feed has not changed
+    content, etag, last_modified = listserv.fetch(
+        state.get('etag'), state.get('last_modified'))
+    if content is None:
+        RSS_FETCHES.labels('not_modified').inc()
+        return
+    RSS_FETCHES.labels('changed').inc()
+    seen = rss.parse_entries(content)
+    entries = rss.select_new_entries(seen, state)
+    inserted = []
+    state['etag'] = etag
+    state['last_modified'] = last_modified
+
+    # Connect to database and establish a cursor
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Package entries keyed by their stable source ID.
+            # Titles longer than the column would abort the run.
+            rows = [("cs-tigerfoodies",
+                     clean_text(entry['title'])[:100],
+                     rss.source_id(entry)) for entry in entries]
+
+            # Insert every new entry in one statement; entries
+            # imported before are skipped by the unique index
+            if rows:
+                inserted = execute_values(cursor, """INSERT INTO
+                    cards (net_id, title, source_id, expiration,
+                    posted_at)
+                    VALUES %s
+                    ON CONFLICT (source_id) DO NOTHING
+                    RETURNING card_id
+                    """, rows, template="""(%s, %s, %s,
+                    CURRENT_TIMESTAMP + interval \'3 hours\',
+                    CURRENT_TIMESTAMP)""", page_size=len(rows),
+                    fetch=True)
+                many_cards_changed(cursor, 'card-created',
+                                   [row[0] for row in inserted])
+
+            # Advance the high-water mark with the inserted cards
+            if entries:
+                state['last_pub_date'] = entries[-1]['pub_date']
+                state['last_guid'] = entries[-1]['guid']
+            rss.save_state(cursor, rss_url, state)
+            conn.commit()
+
+    # Entries at or before the high-water mark and duplicates count as
+    # skipped
+    RSS_ITEMS.labels('seen').inc(len(seen))
+    RSS_ITEMS.labels('inserted').inc(len(inserted))
+    RSS_ITEMS.labels('skipped').inc(len(seen) - len(inserted))
@@ -0,0 +1,145 @@
+#-----------------------------------------------------------------------
+# mailer.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import smtplib
+from datetime import timedelta
+from email.message import EmailMessage
+from dotenv import load_dotenv
+from .database import get_connection
+from .metrics import EMAILS
+
+#-----------------------------------------------------------------------
+
+# Email configuration; point MAIL_SERVER/MAIL_PORT at a local stand-in
+# such as aiosmtpd with MAIL_USE_SSL=false to test without Gmail
+load_dotenv()
+MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+MAIL_PORT = int(os.environ.get('MAIL_PORT', 465))
+MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', 'true').lower() == 'true'
+MAIL_USERNAME = os.environ.get('EMAIL_USER')
+MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
+MAIL_TIMEOUT = 30
+
+# Messages sent per run, attempts before a message is dead-lettered,
+# and the base of the exponential retry delay
+MAIL_BATCH_SIZE = 50
+MAIL_MAX_ATTEMPTS = 5
+MAIL_RETRY_BASE = timedelta(minutes=1)
+
+#-----------------------------------------------------------------------
+
+# Queue an email inside the caller's transaction
+def queue_email(cursor, subject, recipients, body):
+    cursor.execute('''INSERT INTO email_outbox (subject, sender,
+        recipients, body) VALUES (%s, %s, %s, %s);''',
+        (subject, MAIL_USERNAME, recipients, body))
+
+#-----------------------------------------------------------------------
+
+# SMTP connection kept open between runs of the sender
+_smtp = None
+
+def _close_smtp():
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except smtplib.SMTPException:
+            pass
+        except OSError:
+            pass
+    _smtp = None
+
+# Return a live SMTP connection, reconnecting only when the server has
+# dropped the previous one
+def _get_smtp():
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        _close_smtp()
+
+    if MAIL_USE_SSL:
+        _smtp = smtplib.SMTP_SSL(MAIL_SERVER, MAIL_PORT,
+                                 timeout=MAIL_TIMEOUT)
+    else:
+        _smtp = smtplib.SMTP(MAIL_SERVER, MAIL_PORT,
+                             timeout=MAIL_TIMEOUT)
+    if MAIL_USERNAME and MAIL_PASSWORD:
+        _smtp.login(MAIL_USERNAME, MAIL_PASSWORD)
+    return _smtp
+
+#-----------------------------------------------------------------------
+
+# Drain due messages from the outbox over one SMTP connection. Each
+# message is claimed, sent and marked in its own transaction, so a crash
+# resends at most the message in flight. Failed messages are retried
+# with exponential backoff and marked dead after MAIL_MAX_ATTEMPTS.
+# When the server cannot be reached the run stops and the messages stay
+# pending without being charged an attempt. Returns (sent, failed).
+def send_queued_emails():
+    sent = failed = 0
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            for _ in range(MAIL_BATCH_SIZE):
+                # Claim the next message; SKIP LOCKED keeps concurrent
+                # senders apart
+                cursor.execute('''SELECT email_id, subject, sender,
+                    recipients, body, attempts FROM email_outbox
+                    WHERE status = 'pending'
+                    AND next_attempt_at <= LOCALTIMESTAMP
+                    ORDER BY email_id LIMIT 1
+                    FOR UPDATE SKIP LOCKED;''')
+                row = cursor.fetchone()
+                if row is None:
+                    break
+                email_id, subject, sender, recipients, body, \
+                    attempts = row
+
+                try:
+                    smtp = _get_smtp()
+                except Exception as ex:
+                    print(str(ex))
+                    _close_smtp()
+                    conn.rollback()
+                    break
+
+                # Any other error is charged to its own message
+                try:
+                    msg = EmailMessage()
+                    msg['Subject'] = subject
+                    msg['From'] = sender
+                    msg['To'] = ', '.join(recipients)
+                    msg.set_content(body)
+                    smtp.send_message(msg)
+                    cursor.execute('''UPDATE email_outbox
+                        SET status = 'sent', attempts = attempts + 1,
+                        sent_at = LOCALTIMESTAMP, last_error = NULL
+                        WHERE email_id = %s;''', (email_id,))
+                    sent += 1
+                    EMAILS.labels('sent').inc()
+                except Exception as ex:
+                    print(str(ex))
+                    # Start the next message on a fresh connection
+                    if isinstance(ex, (smtplib.SMTPException, OSError)):
+                        _close_smtp()
+                    attempts += 1
+                    status = 'dead' if attempts >= MAIL_MAX_ATTEMPTS \
+                        else 'pending'
+                    cursor.execute('''UPDATE email_outbox
+                        SET status = %s, attempts = %s, last_error = %s,
+                        next_attempt_at = LOCALTIMESTAMP + %s
+                        WHERE email_id = %s;''',
+                        (status, attempts, str(ex),
+                         MAIL_RETRY_BASE * 2 ** (attempts - 1),
+                         email_id))
+                    failed += 1
+                    EMAILS.labels('failed').inc()
+                conn.commit()
+    return sent, failed
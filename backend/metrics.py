@@ -0,0 +1,129 @@
+#-----------------------------------------------------------------------
+# metrics.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client import CollectorRegistry, REGISTRY
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess, start_http_server
+
+#-----------------------------------------------------------------------
+
+# Directory shared by gunicorn workers so /metrics aggregates across
+# them; gunicorn.conf.py cleans up after workers that exit
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+#-----------------------------------------------------------------------
+
+# HTTP requests
+REQUEST_LATENCY = Histogram(
+    'tigerfoodies_request_duration_seconds',
+    'Time spent handling requests', ['method', 'route'])
+REQUESTS = Counter(
+    'tigerfoodies_requests_total', 'Requests handled',
+    ['method', 'route', 'status'])
+REQUESTS_IN_FLIGHT = Gauge(
+    'tigerfoodies_requests_in_flight', 'Requests being handled',
+    multiprocess_mode='livesum')
+
+# Database
+DB_ERRORS = Counter(
+    'tigerfoodies_db_errors_total',
+    'Failed database blocks, by exception type', ['error'])
+
+# Scheduled jobs, reported by the worker process
+JOB_DURATION = Histogram(
+    'tigerfoodies_job_duration_seconds', 'Time spent in scheduled jobs',
+    ['job'], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+JOB_FAILURES = Counter(
+    'tigerfoodies_job_failures_total', 'Scheduled job runs that failed',
+    ['job'])
+JOB_SKIPPED = Counter(
+    'tigerfoodies_job_skipped_total',
+    'Scheduled job runs skipped because the previous run was going',
+    ['job'])
+JOB_LAST_SUCCESS = Gauge(
+    'tigerfoodies_job_last_success_timestamp_seconds',
+    'When each scheduled job last succeeded', ['job'],
+    multiprocess_mode='max')
+SCHEDULER_HEARTBEAT = Gauge(
+    'tigerfoodies_scheduler_heartbeat_timestamp_seconds',
+    'When the scheduler loop last ran', multiprocess_mode='max')
+SCHEDULER_LEADER = Gauge(
+    'tigerfoodies_scheduler_leader',
+    'Whether this worker holds the scheduler lock',
+    multiprocess_mode='livemax')
+
+# Listserv scraper
+RSS_FETCHES = Counter(
+    'tigerfoodies_rss_fetches_total',
+    'Listserv feed fetches, by whether the feed changed', ['result'])
+RSS_ITEMS = Counter(
+    'tigerfoodies_rss_items_total',
+    'Listserv entries seen, inserted and skipped', ['result'])
+
+# Outbox emails
+EMAILS = Counter(
+    'tigerfoodies_emails_total', 'Outbox emails sent or failed',
+    ['result'])
+
+# In-process caches; the hit ratio is hits over all lookups
+CACHE_LOOKUPS = Counter(
+    'tigerfoodies_cache_lookups_total', 'Cache lookups',
+    ['cache', 'result'])
+
+#-----------------------------------------------------------------------
+
+# Render every metric, summed over all workers in multiprocess mode
+def render():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+# Serve metrics from a process without a Flask app, like the worker
+def serve(port):
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
+
+# Record latency, status and concurrency of every request of an app,
+# and expose the metrics at /metrics
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_in_flight = True
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def finish_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else \
+                'unmatched'
+            REQUEST_LATENCY.labels(request.method, route).observe(
+                time.perf_counter() - start)
+            REQUESTS.labels(request.method, route,
+                            str(response.status_code)).inc()
+        return response
+
+    @app.teardown_request
+    def end_request(exception):
+        if g.pop('metrics_in_flight', False):
+            REQUESTS_IN_FLIGHT.dec()
+
+    @app.route('/metrics')
+    def get_metrics():
+        return app.response_class(render(),
+                                  content_type=CONTENT_TYPE_LATEST)
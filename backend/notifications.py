@@ -0,0 +1,150 @@
+#-----------------------------------------------------------------------
+# notifications.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import json
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from .database import DATABASE_URL
+
+#-----------------------------------------------------------------------
+
+# Channels used to announce writes to the cards and comments tables
+CARDS_CHANNEL = 'cards_changed'
+COMMENTS_CHANNEL = 'comments_changed'
+
+# Seconds between reconnect attempts and between idle wake-ups
+_RETRY_DELAY = 5
+_POLL_TIMEOUT = 5
+
+# Callbacks registered per channel
+_listeners = {}
+_lock = threading.Lock()
+
+# Listener thread state for the current process
+_thread = None
+_thread_pid = None
+_connected = threading.Event()
+
+#-----------------------------------------------------------------------
+
+# Queue a notification inside the caller's transaction. Postgres only
+# delivers it once the transaction commits, so listeners never see a
+# change that was rolled back.
+def notify(cursor, channel, payload=''):
+    cursor.execute('SELECT pg_notify(%s, %s);', (channel, str(payload)))
+
+# Queue a named event with a JSON body. Event IDs come from a shared
+# sequence, so every worker sees the same ID for the same event.
+def publish(cursor, channel, event, data):
+    cursor.execute('''SELECT pg_notify(%s, json_build_object(
+        'id', nextval('event_ids'), 'event', %s,
+        'data', %s::json)::text);''',
+        (channel, event, json.dumps(data)))
+
+# Queue one event per item of data_list in a single statement
+def publish_many(cursor, channel, event, data_list):
+    cursor.execute('''SELECT pg_notify(%s, json_build_object(
+        'id', nextval('event_ids'), 'event', %s,
+        'data', data)::text)
+        FROM unnest(%s::json[]) WITH ORDINALITY AS items(data, n)
+        ORDER BY n;''',
+        (channel, event, [json.dumps(data) for data in data_list]))
+
+#-----------------------------------------------------------------------
+
+# Register a callback for a channel. The callback receives the payload
+# string, or None after a reconnect when notifications may have been
+# missed.
+def listen(channel, callback):
+    with _lock:
+        _listeners.setdefault(channel, []).append(callback)
+    _ensure_thread()
+
+# Whether this process is currently receiving notifications
+def is_listening():
+    _ensure_thread()
+    return _thread_pid == os.getpid() and _connected.is_set()
+
+# Wait up to timeout seconds for the listener to connect, by which time
+# its reconnect signal has been delivered. Returns whether it did.
+def wait_listening(timeout):
+    _ensure_thread()
+    return _connected.wait(timeout)
+
+#-----------------------------------------------------------------------
+
+# Start the listener thread once per process (again after a fork)
+def _ensure_thread():
+    global _thread, _thread_pid
+    pid = os.getpid()
+    if _thread is not None and _thread_pid == pid:
+        return
+    with _lock:
+        if _thread is not None and _thread_pid == pid:
+            return
+        _connected.clear()
+        _thread = threading.Thread(target=_run, daemon=True)
+        _thread_pid = pid
+        _thread.start()
+
+def _dispatch(channel, payload):
+    with _lock:
+        callbacks = list(_listeners.get(channel, []))
+    for callback in callbacks:
+        try:
+            callback(payload)
+        except Exception as ex:
+            print(str(ex))
+
+# Hold one dedicated connection per process and fan notifications out
+# to the registered callbacks
+def _run():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            listening = set()
+
+            while True:
+                # Subscribe to channels registered since the last pass
+                with _lock:
+                    channels = set(_listeners) - listening
+                with conn.cursor() as cursor:
+                    for channel in channels:
+                        cursor.execute('LISTEN %s;' % channel)
+                        listening.add(channel)
+
+                # Anything may have changed while we were offline.
+                # Signal that before reporting the connection, so
+                # nobody sees it after is_listening() turned true.
+                if not _connected.is_set():
+                    for channel in listening:
+                        _dispatch(channel, None)
+                    _connected.set()
+
+                if select.select([conn], [], [], _POLL_TIMEOUT) == \
+                        ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    _dispatch(notification.channel,
+                              notification.payload)
+        except Exception as ex:
+            print(str(ex))
+        finally:
+            _connected.clear()
+            if conn is not None:
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+        time.sleep(_RETRY_DELAY)
@@ -0,0 +1,256 @@
+#-----------------------------------------------------------------------
+# profiling.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import json
+import time
+import random
+import threading
+import weakref
+import cProfile
+
+# pyinstrument is optional; cProfile is always available
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+#-----------------------------------------------------------------------
+
+# Per-request instrumentation is off unless PROFILE_REQUESTS=true
+PROFILE_REQUESTS = \
+    os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true'
+
+# Fraction of requests run under a profiler, and how slow a profiled
+# request must be, in milliseconds, for its trace to be kept
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+
+# Where traces are written, and whether to use pyinstrument
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILER = os.environ.get('PROFILER', 'cprofile').lower()
+
+#-----------------------------------------------------------------------
+
+# Under gunicorn's eventlet worker every request runs in one OS thread,
+# so the thread clock would charge each request for everything that ran
+# beside it. CPU is then counted per green thread at every switch.
+class GreenClock:
+    def __init__(self):
+        import greenlet
+        self._getcurrent = greenlet.getcurrent
+        self._spent = weakref.WeakKeyDictionary()
+        self._since = time.thread_time()
+        self._previous = greenlet.settrace(self._trace)
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin = args[0]
+            now = time.thread_time()
+            self._spent[origin] = (self._spent.get(origin, 0.0)
+                                   + now - self._since)
+            self._since = now
+        if self._previous is not None:
+            self._previous(event, args)
+
+    # CPU seconds the running green thread has used so far
+    def __call__(self):
+        return (self._spent.get(self._getcurrent(), 0.0)
+                + time.thread_time() - self._since)
+
+# CPU clock of the running request; replaced by a GreenClock in
+# init_app under eventlet
+_cpu_clock = time.thread_time
+
+# Timings and counts gathered while one request is handled
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = _cpu_clock()
+        self.acquire = 0.0
+        self.query = 0.0
+        self.serialize = 0.0
+        self.statements = 0
+        self.rows = 0
+
+_local = threading.local()
+
+# Stats of the request this thread is handling, or None
+def current():
+    return getattr(_local, 'stats', None)
+
+# Charge time spent waiting for a pooled connection
+def add_acquire(seconds):
+    stats = current()
+    if stats is not None:
+        stats.acquire += seconds
+
+# Charge one executed statement and the rows it returned or touched
+def add_query(seconds, rows):
+    stats = current()
+    if stats is not None:
+        stats.query += seconds
+        stats.statements += 1
+        stats.rows += max(rows, 0)
+
+# Wrap an encoder so the time spent in it is charged to the request
+def timed_serializer(func):
+    def wrapper(*args, **kwargs):
+        stats = current()
+        if stats is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.serialize += time.perf_counter() - start
+    return wrapper
+
+#-----------------------------------------------------------------------
+
+# Totals per route for this process, guarded by _totals_lock
+_totals = {}
+_totals_lock = threading.Lock()
+
+def _add_to_totals(route, record):
+    with _totals_lock:
+        totals = _totals.setdefault(route, {
+            'requests': 0, 'errors': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0,
+            'acquire_ms': 0.0, 'query_ms': 0.0, 'serialize_ms': 0.0,
+            'statements': 0, 'rows': 0})
+        totals['requests'] += 1
+        if record['status'] >= 500:
+            totals['errors'] += 1
+        for key in ('wall_ms', 'cpu_ms', 'acquire_ms', 'query_ms',
+                    'serialize_ms', 'statements', 'rows'):
+            totals[key] += record[key]
+
+# Per-route totals, busiest routes by CPU time first
+def route_stats():
+    with _totals_lock:
+        routes = [dict(totals, route=route)
+                  for route, totals in _totals.items()]
+    for totals in routes:
+        for key in ('wall_ms', 'cpu_ms', 'acquire_ms', 'query_ms',
+                    'serialize_ms'):
+            totals[key] = round(totals[key], 3)
+    routes.sort(key=lambda totals: totals['cpu_ms'], reverse=True)
+    return {'pid': os.getpid(), 'routes': routes}
+
+#-----------------------------------------------------------------------
+
+# Only one profiler can run in a process at a time
+_profiler_lock = threading.Lock()
+
+# Profilers see the whole OS thread, which under eventlet mixes every
+# request together, so traces are only sampled on thread workers
+def _start_profiler():
+    if isinstance(_cpu_clock, GreenClock):
+        return None
+    if not PROFILE_SAMPLE_RATE or \
+            random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    try:
+        if PROFILER == 'pyinstrument' and pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+    except Exception:
+        _profiler_lock.release()
+        raise
+
+def _stop_profiler(profiler):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+    else:
+        profiler.stop()
+
+# Stop the profiler and keep its trace if the request was slow
+def _finish_profiler(profiler, route, wall_ms):
+    try:
+        _stop_profiler(profiler)
+        if wall_ms < PROFILE_SLOW_MS:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = '%s-%d-%d' % (
+            route.strip('/').replace('/', '_').replace('<', '')
+            .replace('>', '').replace(':', '-') or 'root',
+            int(time.time() * 1000), os.getpid())
+        path = os.path.join(PROFILE_DIR, name)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.dump_stats(path + '.prof')
+        else:
+            with open(path + '.html', 'w') as file:
+                file.write(profiler.output_html())
+    except Exception as ex:
+        print(str(ex))
+    finally:
+        _profiler_lock.release()
+
+#-----------------------------------------------------------------------
+
+# Instrument every request of a Flask app, logging one JSON line per
+# request and keeping per-route totals
+def init_app(app):
+    from flask import request
+    from .database import eventlet_patched
+    global _cpu_clock
+
+    if eventlet_patched():
+        _cpu_clock = GreenClock()
+
+    @app.before_request
+    def start_request():
+        _local.stats = RequestStats()
+        _local.profiler = _start_profiler()
+
+    @app.after_request
+    def finish_request(response):
+        stats = current()
+        if stats is None:
+            return response
+        profiler = getattr(_local, 'profiler', None)
+        _local.stats = None
+        _local.profiler = None
+
+        route = request.url_rule.rule if request.url_rule else \
+            'unmatched'
+        wall_ms = (time.perf_counter() - stats.start) * 1000
+        record = {
+            'method': request.method,
+            'route': route,
+            'status': response.status_code,
+            'wall_ms': round(wall_ms, 3),
+            'cpu_ms': round(
+                (_cpu_clock() - stats.cpu_start) * 1000, 3),
+            'acquire_ms': round(stats.acquire * 1000, 3),
+            'query_ms': round(stats.query * 1000, 3),
+            'serialize_ms': round(stats.serialize * 1000, 3),
+            'statements': stats.statements,
+            'rows': stats.rows,
+        }
+        if profiler is not None:
+            _finish_profiler(profiler, route, wall_ms)
+        _add_to_totals(f'{request.method} {route}', record)
+        print(json.dumps(record))
+        return response
+
+    # Requests that died before after_request must not keep holding
+    # the profiler
+    @app.teardown_request
+    def abandon_request(exception):
+        profiler = getattr(_local, 'profiler', None)
+        _local.stats = None
+        _local.profiler = None
+        if profiler is not None:
+            try:
+                _stop_profiler(profiler)
+            finally:
+                _profiler_lock.release()
@@ -0,0 +1,144 @@
+#-----------------------------------------------------------------------
+# rss.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import hashlib
+from datetime import datetime, timedelta
+import pytz
+import requests
+from bs4 import BeautifulSoup
+
+#-----------------------------------------------------------------------
+
+# Seconds to wait on the listserv before giving up on a request
+LISTSERV_TIMEOUT = 20
+
+# How far back to import when there is no stored high-water mark yet
+INITIAL_LOOKBACK = timedelta(minutes=30)
+
+# Set timezone used in RSS script
+utc = pytz.timezone('UTC')
+
+#-----------------------------------------------------------------------
+
+# Authenticated client for the freefood listserv RSS feed. The session
+# and its cookies survive between runs, so we only log in again once
+# the listserv sends us back to its login page.
+class ListservClient:
+    def __init__(self, url):
+        self._url = url
+        self._session = requests.Session()
+
+    # Log into the listserv using the hidden fields of its login page
+    def _login(self, login_page):
+        soup_login = BeautifulSoup(login_page.text, "lxml")
+        hidden_inputs = soup_login.find_all("input", type="hidden")
+        payload = {input_tag["name"]: input_tag.get("value", "")
+                   for input_tag in hidden_inputs}
+        payload["Y"] = os.environ["LISTSERV_USERNAME"]
+        payload["p"] = os.environ["PASS"]
+        self._session.post(self._url, data=payload,
+                           timeout=LISTSERV_TIMEOUT)
+
+    # Fetch the feed, sending the validators from the previous fetch.
+    # Returns (content, etag, last_modified), with content None when
+    # the feed has not changed.
+    def fetch(self, etag=None, last_modified=None):
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        for attempt in range(2):
+            response = self._session.get(self._url, headers=headers,
+                                         timeout=LISTSERV_TIMEOUT)
+            if response.status_code == 304:
+                return None, etag, last_modified
+            response.raise_for_status()
+            if _is_feed(response):
+                return (response.content,
+                        response.headers.get('ETag'),
+                        response.headers.get('Last-Modified'))
+            # Session expired or never existed, so log in and retry
+            if attempt == 0:
+                self._login(response)
+        raise RuntimeError('Could not log into the listserv')
+
+# Whether a response is the RSS document rather than a login page
+def _is_feed(response):
+    return b'<rss' in response.content[:1024]
+
+#-----------------------------------------------------------------------
+
+# Parse the RSS document into entries, newest first
+def parse_entries(content):
+    soup_scrape = BeautifulSoup(content, "xml")
+    entries = []
+    for item in soup_scrape.find_all("item"):
+        pub_date = datetime.strptime(item.pubDate.text,
+                                     "%a, %d %b %Y %H:%M:%S %z")
+        guid = item.guid.text if item.guid else None
+        if not guid and item.link:
+            guid = item.link.text
+        entries.append({'guid': guid, 'title': item.title.text,
+                        'pub_date': pub_date})
+    entries.sort(key=lambda entry: entry['pub_date'], reverse=True)
+    return entries
+
+# Stable identifier of an entry: its GUID, or a content hash for
+# feeds that omit one
+def source_id(entry):
+    if entry['guid']:
+        return entry['guid']
+    content = entry['title'] + '|' + entry['pub_date'].isoformat()
+    return 'sha1:' + hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+# Entries published after the stored high-water mark, oldest first.
+# Entries sharing the mark's timestamp are told apart by GUID: only the
+# marked one is skipped, since the feed may list the others on either
+# side of it, and any already imported are dropped by the source_id
+# index.
+def select_new_entries(entries, state):
+    mark = state.get('last_pub_date')
+    if mark is None:
+        mark = datetime.now(utc) - INITIAL_LOOKBACK
+    new_entries = []
+    for entry in entries:
+        if entry['pub_date'] < mark:
+            break
+        if (entry['pub_date'] == mark
+                and entry['guid'] == state.get('last_guid')):
+            continue
+        new_entries.append(entry)
+    new_entries.reverse()
+    return new_entries
+
+#-----------------------------------------------------------------------
+
+# Load the stored fetch state for a feed
+def load_state(cursor, feed_url):
+    cursor.execute('''SELECT last_pub_date, last_guid, etag,
+        last_modified FROM rss_state WHERE feed_url = %s;''',
+        (feed_url,))
+    row = cursor.fetchone()
+    if row is None:
+        return {}
+    return {'last_pub_date': row[0], 'last_guid': row[1],
+            'etag': row[2], 'last_modified': row[3]}
+
+# Store the fetch state for a feed, in the same transaction as the
+# entries it covers so a crash can never skip posts
+def save_state(cursor, feed_url, state):
+    cursor.execute('''INSERT INTO rss_state (feed_url, last_pub_date,
+        last_guid, etag, last_modified)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (feed_url) DO UPDATE SET
+        last_pub_date = EXCLUDED.last_pub_date,
+        last_guid = EXCLUDED.last_guid,
+        etag = EXCLUDED.etag,
+        last_modified = EXCLUDED.last_modified;''',
+        (feed_url, state.get('last_pub_date'), state.get('last_guid'),
+         state.get('etag'), state.get('last_modified')))
@@ -0,0 +1,13 @@
+#-----------------------------------------------------------------------
+# sanitize.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+# Canonical stored form of user-entered text: the raw text, exactly as
+# written and as the API returns it. React escapes text when rendering
+# it and emails are plain text, so no HTML pass is needed on write or
+# read. Only NUL is dropped, since Postgres text cannot hold it.
+def clean_text(value):
+    if value is None:
+        return None
+    return value.replace('\x00', '')
@@ -0,0 +1,125 @@
+#-----------------------------------------------------------------------
+# serialize.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import json
+import decimal
+from datetime import date
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+from . import profiling
+
+# orjson is optional; without it responses use the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#-----------------------------------------------------------------------
+
+# Which encoder to use: "orjson", "json", or "auto" for orjson when it
+# is installed
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto').lower()
+if JSON_ENCODER == 'auto':
+    JSON_ENCODER = 'orjson' if orjson is not None else 'json'
+elif JSON_ENCODER == 'orjson' and orjson is None:
+    raise ImportError('JSON_ENCODER=orjson but orjson is not installed')
+
+# Whether Postgres builds the card feed JSON itself with json_agg,
+# leaving Python to pass the bytes through
+SQL_JSON = os.environ.get('SQL_JSON', 'false').lower() == 'true'
+
+# Format rendering a timestamp in SQL the way _default does
+SQL_HTTP_DATE = 'Dy, DD Mon YYYY HH24:MI:SS "GMT"'
+
+#-----------------------------------------------------------------------
+
+# Encode the types JSON has no native form for the way Flask always
+# has: dates as HTTP dates, which the frontend parses, and decimals as
+# strings
+def _default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} '
+                    'is not JSON serializable')
+
+if JSON_ENCODER == 'orjson':
+    # Dates are passed through to _default to keep the HTTP format
+    _ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME
+                       | orjson.OPT_SORT_KEYS
+                       | orjson.OPT_NON_STR_KEYS)
+
+    # Serialize to UTF-8 bytes
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default,
+                            option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=_default, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+
+# Charge encoding time to the request being profiled
+if profiling.PROFILE_REQUESTS:
+    dumps = profiling.timed_serializer(dumps)
+
+#-----------------------------------------------------------------------
+
+# Flask JSON provider backed by dumps, so jsonify and app.json share
+# the fast encoder
+class FastJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    # Skip the str round trip and hand the encoded bytes to Flask
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj),
+                                        mimetype='application/json')
+
+#-----------------------------------------------------------------------
+
+# Packer turning rows of the cursor's last query into dicts keyed by
+# column name. Stored text is already in its final form, so values are
+# passed through untouched.
+def row_packer(cursor):
+    names = tuple(column.name for column in cursor.description)
+    return lambda row: dict(zip(names, row))
+
+# Fetch every remaining row of the cursor as a dict
+def fetch_dicts(cursor):
+    pack = row_packer(cursor)
+    return [pack(row) for row in cursor.fetchall()]
+
+# Fetch the next row of the cursor as a dict, or None
+def fetch_dict(cursor):
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row_packer(cursor)(row)
+
+# SQL expression building the same JSON object dumps would for a row
+# of the given columns: keys sorted and timestamps as HTTP dates
+def sql_json_object(columns, timestamps=()):
+    fields = []
+    for column in sorted(columns):
+        value = column
+        if column in timestamps:
+            value = f"to_char({column}, '{SQL_HTTP_DATE}')"
+        fields.append(f"'{column}', {value}")
+    return 'json_build_object(' + ', '.join(fields) + ')'
@@ -0,0 +1,124 @@
+#-----------------------------------------------------------------------
+# sessions.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import json
+import secrets
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from .database import get_connection
+from .ttl_cache import TTLCache
+
+#-----------------------------------------------------------------------
+
+# Where sessions live: "cookie" keeps them in a cookie signed with the
+# shared SECRET_KEY, "postgres" keeps only an ID in the cookie and the
+# data in the sessions table
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie').lower()
+
+# Sessions each worker keeps in memory in front of Postgres, and for
+# how many seconds
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+SESSION_CACHE_TTL = int(os.environ.get('SESSION_CACHE_TTL', 300))
+
+#-----------------------------------------------------------------------
+
+# Session dict that notices when it is changed
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+# Sessions stored in Postgres under a random ID held in the cookie.
+# Lookups hit an in-process LRU first, so most requests never reach the
+# database; rows are only written when the session changes.
+class PostgresSessionInterface(SessionInterface):
+    def __init__(self, cache):
+        self._cache = cache
+
+    def _load(self, sid):
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''SELECT data FROM sessions
+                    WHERE session_id = %s
+                    AND expires_at > LOCALTIMESTAMP;''', (sid,))
+                row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _store(self, sid, data, lifetime):
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''INSERT INTO sessions (session_id,
+                    data, expires_at)
+                    VALUES (%s, %s::jsonb, LOCALTIMESTAMP + %s)
+                    ON CONFLICT (session_id) DO UPDATE SET
+                    data = EXCLUDED.data,
+                    expires_at = EXCLUDED.expires_at;''',
+                    (sid, json.dumps(data), lifetime))
+
+    def _delete(self, sid):
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''DELETE FROM sessions
+                    WHERE session_id = %s;''', (sid,))
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self._cache.get(sid)
+            if data is None:
+                data = self._load(sid)
+                if data is not None:
+                    self._cache.set(sid, data)
+            if data is not None:
+                return ServerSession(data, sid)
+        # Unknown IDs are never reused, so a planted cookie cannot fix
+        # the session of the next login
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # An emptied session is removed along with its cookie
+        if not session:
+            if session.modified and not session.new:
+                self._delete(session.sid)
+                self._cache.discard(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add('Cookie')
+            return
+
+        response.vary.add('Cookie')
+        if session.modified:
+            data = dict(session)
+            self._store(session.sid, data,
+                        app.permanent_session_lifetime)
+            self._cache.set(session.sid, data)
+        if not self.should_set_cookie(app, session):
+            return
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app))
+
+#-----------------------------------------------------------------------
+
+# Install the configured session backend on an app
+def init_app(app):
+    if SESSION_BACKEND == 'postgres':
+        app.session_interface = PostgresSessionInterface(TTLCache(
+            maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL,
+            name='sessions'))
+    elif SESSION_BACKEND != 'cookie':
+        raise ValueError(f'Unknown SESSION_BACKEND {SESSION_BACKEND}')
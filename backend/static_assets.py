@@ -0,0 +1,123 @@
+#-----------------------------------------------------------------------
+# static_assets.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import gzip
+import json
+import hashlib
+import mimetypes
+
+# Brotli is optional; without it only gzip variants are served
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#-----------------------------------------------------------------------
+
+# File types worth compressing. Source maps are left out because only
+# developer tools fetch them and they are slow to compress at startup.
+COMPRESSIBLE = {'.html', '.js', '.css', '.svg', '.json', '.txt'}
+
+# Cache headers for content-hashed files and for everything else
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+#-----------------------------------------------------------------------
+
+# One servable file, with its body held in memory in every encoding
+class Asset:
+    def __init__(self, path, body, immutable):
+        self.mimetype = (mimetypes.guess_type(path)[0]
+                         or 'application/octet-stream')
+        self.digest = hashlib.sha1(body).hexdigest()
+        self.cache_control = IMMUTABLE_CACHE if immutable \
+            else REVALIDATE_CACHE
+        self.variants = {'identity': body}
+
+    # Keep a compressed variant only when it actually saves bytes
+    def add_variant(self, encoding, body):
+        if len(body) < len(self.variants['identity']):
+            self.variants[encoding] = body
+
+    # Each encoding is a different representation, so it gets its own
+    # strong ETag
+    def etag(self, encoding):
+        if encoding == 'identity':
+            return self.digest
+        return f'{self.digest}-{encoding}'
+
+    # Pick the best encoding the client accepts
+    def choose(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and \
+                    accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+#-----------------------------------------------------------------------
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+# Index every file of the React build at startup. Files listed in
+# asset-manifest.json under static/ carry a content hash in their name
+# and are cached forever; the rest, like index.html, are revalidated by
+# ETag. Precompressed .gz/.br files from the build are used when
+# present, otherwise variants are compressed here once.
+def build_index(root):
+    hashed = set()
+    manifest_path = os.path.join(root, 'asset-manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            for url in json.load(manifest).get('files', {}).values():
+                path = url.lstrip('/')
+                if path.startswith('static/'):
+                    hashed.add(path)
+
+    index = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(('.gz', '.br')):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            path = os.path.relpath(full_path, root).replace(os.sep, '/')
+            asset = Asset(path, _read(full_path), path in hashed)
+
+            if os.path.splitext(filename)[1] in COMPRESSIBLE:
+                body = asset.variants['identity']
+                if os.path.exists(full_path + '.gz'):
+                    asset.add_variant('gzip', _read(full_path + '.gz'))
+                else:
+                    asset.add_variant('gzip', gzip.compress(
+                        body, compresslevel=9, mtime=0))
+                if os.path.exists(full_path + '.br'):
+                    asset.add_variant('br', _read(full_path + '.br'))
+                elif brotli is not None:
+                    asset.add_variant('br', brotli.compress(
+                        body, quality=9))
+            index[path] = asset
+    return index
+
+#-----------------------------------------------------------------------
+
+# Build the response for an indexed asset, answering 304 when the
+# client holds a current copy in any encoding
+def asset_response(response_class, request, asset):
+    for encoding in asset.variants:
+        if request.if_none_match.contains(asset.etag(encoding)):
+            response = response_class(status=304)
+            break
+    else:
+        encoding = asset.choose(request.accept_encodings)
+        response = response_class(asset.variants[encoding],
+                                  mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(asset.etag(encoding))
+    response.headers['Cache-Control'] = asset.cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,138 @@
+#-----------------------------------------------------------------------
+# stream.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import json
+import threading
+from collections import deque
+from . import notifications
+
+#-----------------------------------------------------------------------
+
+# Seconds between heartbeats on an idle stream
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+
+# Number of recent events kept per worker for Last-Event-ID resume
+STREAM_BACKLOG = int(os.environ.get('STREAM_BACKLOG', 1000))
+
+# Milliseconds browsers wait before reconnecting a dropped stream
+STREAM_RETRY = 5000
+
+#-----------------------------------------------------------------------
+
+# Per-worker fan-out of database notifications to every open stream.
+# Events are kept in delivery order, which Postgres makes identical on
+# every listener, so a client can resume on any worker.
+class EventHub:
+    def __init__(self, channels, backlog=STREAM_BACKLOG):
+        self._channels = channels
+        self._cond = threading.Condition()
+        # Recent events as (id, position, formatted message)
+        self._events = deque(maxlen=backlog)
+        # Position of the next event; bumped past gaps on reconnect
+        self._position = 0
+        self._gap = 0
+        self._subscribed_pid = None
+
+    def _subscribe(self):
+        pid = os.getpid()
+        if self._subscribed_pid != pid:
+            self._subscribed_pid = pid
+            for channel in self._channels:
+                notifications.listen(channel, self._on_notify)
+
+    # Record a notification and wake every waiting stream
+    def _on_notify(self, payload):
+        with self._cond:
+            if payload is None:
+                # Events may have been missed; resumes must not span
+                # this point
+                self._events.clear()
+                self._gap += 1
+            else:
+                try:
+                    event = json.loads(payload)
+                    message = _format(event['id'], event['event'],
+                                      event['data'])
+                except (ValueError, KeyError):
+                    return
+                self._position += 1
+                self._events.append(
+                    (str(event['id']), self._position, message))
+            self._cond.notify_all()
+
+    # Position just after the event with the given ID, or None when it
+    # is no longer in the backlog
+    def _resume_position(self, last_event_id):
+        for event_id, position, _ in self._events:
+            if event_id == last_event_id:
+                return position
+        return None
+
+    # Generator of SSE messages for one client
+    def stream(self, last_event_id=None):
+        self._subscribe()
+
+        # The listener's first connect in this worker signals a
+        # reconnect, which a stream started before it would take for
+        # lost events
+        notifications.wait_listening(STREAM_HEARTBEAT)
+        with self._cond:
+            gap = self._gap
+            if last_event_id:
+                position = self._resume_position(last_event_id)
+            else:
+                position = self._position
+
+        yield 'retry: %d\n\n' % STREAM_RETRY
+
+        # The client's last event is gone, so it has to refetch
+        if position is None:
+            yield _format(None, 'reset', {})
+            with self._cond:
+                position = self._position
+
+        while True:
+            with self._cond:
+                if self._gap == gap and self._position == position:
+                    self._cond.wait(STREAM_HEARTBEAT)
+                # A reconnect or a client too slow for the backlog
+                # means events were lost
+                lagging = (self._events and
+                           self._events[0][1] > position + 1)
+                if self._gap != gap or lagging:
+                    gap = self._gap
+                    position = self._position
+                    messages = None
+                else:
+                    messages = [message for _, event_position, message
+                                in self._events
+                                if event_position > position]
+                    position = self._position
+
+            if messages is None:
+                yield _format(None, 'reset', {})
+            elif messages:
+                yield ''.join(messages)
+            else:
+                # Comment line keeps proxies from closing the stream
+                yield ': heartbeat\n\n'
+
+#-----------------------------------------------------------------------
+
+# Format one SSE message
+def _format(event_id, event, data):
+    message = ''
+    if event_id is not None:
+        message += 'id: %s\n' % event_id
+    message += 'event: %s\n' % event
+    message += 'data: %s\n\n' % json.dumps(data)
+    return message
+
+#-----------------------------------------------------------------------
+
+# Hub shared by every /api/stream request in this worker
+event_hub = EventHub([notifications.CARDS_CHANNEL,
+                      notifications.COMMENTS_CHANNEL])
@@ -0,0 +1,35 @@
+#-----------------------------------------------------------------------
+# tags.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+# Dietary tags and allergens are stored in the case the frontend uses,
+# e.g. "Vegan", "Gluten-Free" and "Nuts". Array containment and overlap
+# in Postgres are case-sensitive, so every value written or filtered on
+# goes through canonical_tag first.
+
+import re
+
+#-----------------------------------------------------------------------
+
+# Runs of letters and digits, which is what Postgres' initcap treats
+# as words
+_WORD = re.compile(r'[^\W_]+')
+
+# Canonical spelling of one tag: trimmed, and each word capitalized the
+# way initcap does it, so the migration in create_tables.py agrees
+def canonical_tag(value):
+    return _WORD.sub(lambda match: match.group(0)[:1].upper()
+                     + match.group(0)[1:].lower(), value.strip())
+
+# Canonical, de-duplicated tags in their original order, skipping
+# blanks; None stays None
+def canonical_tags(values):
+    if values is None:
+        return None
+    tags = []
+    for value in values:
+        tag = canonical_tag(value)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
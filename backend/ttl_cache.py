@@ -0,0 +1,64 @@
+#-----------------------------------------------------------------------
+# ttl_cache.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import threading
+import time
+from collections import OrderedDict
+from .metrics import CACHE_LOOKUPS
+
+#-----------------------------------------------------------------------
+
+# Thread-safe, size-bounded mapping whose entries expire after ttl
+# seconds. The least recently used entry is evicted when full. Named
+# caches report their lookups as metrics.
+class TTLCache:
+    def __init__(self, maxsize, ttl, name=None):
+        self._maxsize = maxsize
+        self._name = name
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        # Counters for cache effectiveness
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cached value, or default if missing or expired
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                self._record('miss')
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._record('hit')
+            return entry[0]
+
+    def _record(self, result):
+        if self._name is not None:
+            CACHE_LOOKUPS.labels(self._name, result).inc()
+
+    def set(self, key, value=True):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses}
@@ -0,0 +1,166 @@
+#-----------------------------------------------------------------------
+# worker.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import threading
+import time
+import psycopg2
+import schedule
+from .database import DATABASE_URL
+from .jobs import clean_expired_cards, fetch_recent_rss_entries
+from .jobs import clean_expired_sessions
+from .mailer import send_queued_emails
+from . import metrics
+
+#-----------------------------------------------------------------------
+
+# Advisory lock key held by whichever worker instance is the leader
+SCHEDULER_LOCK_KEY = 8146020
+
+# Seconds between job runs, randomized by up to JOB_JITTER either way
+# so instances and jobs do not fire in lockstep. Reads filter out
+# expired cards themselves, so the sweep only needs to run now and
+# then to keep the table small.
+RSS_INTERVAL = int(os.environ.get('RSS_INTERVAL', 60))
+SWEEP_INTERVAL = int(os.environ.get('SWEEP_INTERVAL', 600))
+EMAIL_INTERVAL = int(os.environ.get('EMAIL_INTERVAL', 10))
+JOB_JITTER = int(os.environ.get('JOB_JITTER', 10))
+
+# Seconds between leadership checks and election attempts
+LEADER_CHECK_INTERVAL = 5
+
+# Port serving this worker's metrics, if any
+METRICS_PORT = os.environ.get('WORKER_METRICS_PORT')
+
+#-----------------------------------------------------------------------
+
+# A scheduled job that never overlaps with itself and keeps timings
+class Job:
+    def __init__(self, func, interval):
+        self.func = func
+        self.name = func.__name__
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_duration = None
+        self.last_success = None
+
+    # Start the job in its own thread unless the previous run is still
+    # going, so a slow listserv never delays the expiration sweep
+    def trigger(self):
+        if not self._lock.acquire(blocking=False):
+            self.skipped += 1
+            metrics.JOB_SKIPPED.labels(self.name).inc()
+            print(f'{self.name}: previous run still in progress, '
+                  'skipping')
+            return
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        start = time.monotonic()
+        try:
+            self.func()
+            self.last_success = time.time()
+            metrics.JOB_LAST_SUCCESS.labels(self.name).set(
+                self.last_success)
+        except Exception as ex:
+            self.failures += 1
+            metrics.JOB_FAILURES.labels(self.name).inc()
+            print(f'{self.name}: {ex}')
+        finally:
+            self.runs += 1
+            self.last_duration = time.monotonic() - start
+            metrics.JOB_DURATION.labels(self.name).observe(
+                self.last_duration)
+            print(f'{self.name}: finished in '
+                  f'{self.last_duration:.3f}s')
+            self._lock.release()
+
+#-----------------------------------------------------------------------
+
+# Leadership backed by a session-level Postgres advisory lock. The lock
+# is released automatically if this process or its connection dies,
+# letting a standby instance take over.
+class LeaderLock:
+    def __init__(self, dsn, key):
+        self._dsn = dsn
+        self._key = key
+        self._conn = None
+
+    def _reset(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+        self._conn = None
+
+    # Whether this instance holds the lock, trying to take it if not
+    def is_leader(self):
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = psycopg2.connect(self._dsn)
+                self._conn.autocommit = True
+                with self._conn.cursor() as cursor:
+                    cursor.execute('SELECT pg_try_advisory_lock(%s);',
+                                   (self._key,))
+                    if not cursor.fetchone()[0]:
+                        self._reset()
+                        return False
+                return True
+
+            # Make sure the session holding the lock is still alive
+            with self._conn.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            return True
+        except psycopg2.Error as ex:
+            print(str(ex))
+            self._reset()
+            return False
+
+#-----------------------------------------------------------------------
+
+jobs = [Job(clean_expired_cards, SWEEP_INTERVAL),
+        Job(fetch_recent_rss_entries, RSS_INTERVAL),
+        Job(send_queued_emails, EMAIL_INTERVAL),
+        Job(clean_expired_sessions, SWEEP_INTERVAL)]
+
+def main():
+    if METRICS_PORT:
+        metrics.serve(int(METRICS_PORT))
+
+    # Run scheduled tasks
+    for job in jobs:
+        jitter = min(JOB_JITTER, job.interval // 2)
+        schedule.every(max(1, job.interval - jitter)).to(
+            job.interval + jitter).seconds.do(job.trigger)
+
+    leader = LeaderLock(DATABASE_URL, SCHEDULER_LOCK_KEY)
+    leading = False
+    last_check = 0
+
+    # Only the instance holding the lock runs jobs; the others wait
+    # to take over
+    while True:
+        now = time.monotonic()
+        if now - last_check >= LEADER_CHECK_INTERVAL:
+            last_check = now
+            is_leader = leader.is_leader()
+            if is_leader != leading:
+                leading = is_leader
+                print('Scheduler leadership ' +
+                      ('acquired' if leading else 'lost'))
+                metrics.SCHEDULER_LEADER.set(1 if leading else 0)
+        metrics.SCHEDULER_HEARTBEAT.set(time.time())
+        if leading:
+            schedule.run_pending()
+        time.sleep(1)
+
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
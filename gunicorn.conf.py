@@ -0,0 +1,70 @@
+#-----------------------------------------------------------------------
+# gunicorn.conf.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+import os
+import glob
+
+#-----------------------------------------------------------------------
+
+# Worker model. The default eventlet worker runs each request in a
+# green thread: sockets, locks and sleeps yield through eventlet's
+# monkey patching, and psycopg2 through psycogreen (see database.py).
+# Database work is still capped by DB_POOL_MAX_SIZE connections per
+# worker. WEB_WORKER_CLASS=sync handles one request at a time, so every
+# slow CAS round trip holds a whole worker, and /api/stream is refused
+# with a 503 because each client would pin one.
+#
+# Compared with the load test, quiet and then with 50 /api/stream
+# clients open and 4 clients logging in through a stand-in CAS that
+# takes 0.5 s to answer:
+#
+#   python -m backend.bench_load --database-url postgres:///bench \
+#       --reset --worker-class sync \
+#       --stream-clients 50 --cas-clients 4 --cas-delay 0.5
+#
+# 2 workers, 8 API clients, 1000 cards, Postgres 16 on the same single
+# vCPU; medians of three 10 s runs:
+#
+#   worker    load    route       req/s   p50 ms   p99 ms  logins/s
+#   sync      quiet   list_cards    248       31       59
+#   sync      quiet   user_cards    219       36       55
+#   sync      loaded  list_cards      9     1052     1087      3.8
+#   sync      loaded  user_cards      9     1047     1082      3.8
+#   eventlet  quiet   list_cards    245       33       63
+#   eventlet  quiet   user_cards    199       39       74
+#   eventlet  loaded  list_cards    258       29       74      7.0
+#   eventlet  loaded  user_cards    184       42       86      7.0
+#
+# Under sync all 50 streams get the 503, and the logins occupy both
+# workers, so API requests queue behind them for about a second and
+# logins cap at 2 workers / 0.5 s. Under eventlet every stream stays
+# open, logins run at nearly the 8/s the clients can issue, and the API
+# keeps its quiet latency apart from a longer p99 tail.
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'eventlet')
+
+# Concurrent clients per green worker
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS',
+                                        1000))
+
+#-----------------------------------------------------------------------
+
+# Metrics from every worker are aggregated through files in
+# PROMETHEUS_MULTIPROC_DIR. The directory belongs to this server alone;
+# give the scheduler worker its own.
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Start from an empty directory so workers of a previous run are not
+# counted as live
+def on_starting(server):
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, '*.db')):
+            os.remove(path)
+
+# Drop the live gauges of a worker that exited
+def child_exit(server, worker):
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
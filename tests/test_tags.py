@@ -0,0 +1,34 @@
+#-----------------------------------------------------------------------
+# test_tags.py
+# Authors: Anha Khan, Arika Hassan, Laiba Ali, Mark Gazzerro, Sami Dalu
+#-----------------------------------------------------------------------
+
+from backend.tags import canonical_tag, canonical_tags
+
+#-----------------------------------------------------------------------
+
+# Values exactly as CreateCard.js and EditCard.js store them
+FRONTEND_DIETARY_TAGS = ['Halal', 'Vegan', 'Gluten-Free']
+FRONTEND_ALLERGIES = ['Nuts', 'Dairy']
+
+#-----------------------------------------------------------------------
+
+def test_frontend_values_are_already_canonical():
+    for value in FRONTEND_DIETARY_TAGS + FRONTEND_ALLERGIES:
+        assert canonical_tag(value) == value
+
+def test_filter_values_in_any_case_become_the_stored_values():
+    assert canonical_tag('vegan') == 'Vegan'
+    assert canonical_tag('GLUTEN-FREE') == 'Gluten-Free'
+    assert canonical_tag(' dairy ') == 'Dairy'
+    assert canonical_tag('nUTS') == 'Nuts'
+
+def test_api_written_tags_are_stored_canonically():
+    assert canonical_tags(['vegan', 'gluten-free', 'Vegan', ' ']) == \
+        ['Vegan', 'Gluten-Free']
+    assert canonical_tags([]) == []
+    assert canonical_tags(None) is None
+
+def test_matches_postgres_initcap():
+    assert canonical_tag('3rd-party nuts') == '3rd-Party Nuts'
+    assert canonical_tag('tree_nuts') == 'Tree_Nuts'